@@ -0,0 +1,90 @@
+# core/activity.py
+
+import heapq
+from base64 import b64decode, b64encode
+from operator import attrgetter
+
+from django.db.models import Case, F, Q, Value, When
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+
+from .models import Transaction
+
+CREDIT_TYPES = ['receive_money', 'deposit']
+DEBIT_TYPES = ['send_money', 'withdrawal']
+
+# ترتيب السجل: الأحدث أولًا، و id يفصل بين المعاملات المتساوية في الوقت
+_sort_key = attrgetter('timestamp', 'id')
+
+
+def encode_cursor(transaction):
+    raw = f"{transaction.timestamp.isoformat()}|{transaction.id}"
+    return b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = b64decode(cursor.encode(), validate=True).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        timestamp = None
+    if timestamp is None:
+        raise NotFound("المؤشر غير صالح.")
+    return timestamp, pk
+
+
+def _after(queryset, position):
+    if position is None:
+        return queryset
+    timestamp, pk = position
+    return queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+
+def _stream(queryset, position, limit):
+    queryset = _after(queryset.filter(timestamp__isnull=False), position)
+    return queryset.order_by('-timestamp', '-id')[:limit]
+
+
+def sent_stream(user, position, limit):
+    """
+    معاملات المستخدم نفسه (فهرس user, -timestamp). الاتجاه حسب نوع المعاملة.
+    """
+    queryset = Transaction.objects.filter(user=user).annotate(
+        direction=Case(When(transaction_type__in=CREDIT_TYPES, then=Value('credit')), default=Value('debit')),
+        counterparty_id=F('recipient_id'),
+    )
+    return _stream(queryset, position, limit)
+
+
+def received_stream(user, position, limit):
+    """
+    معاملات يكون فيها المستخدم هو الطرف الآخر (فهرس recipient, -timestamp):
+    send_money من غيره تزيد رصيده، و receive_money تعني أنه هو الدافع.
+    """
+    queryset = Transaction.objects.filter(recipient=user).exclude(user=user).annotate(
+        direction=Case(When(transaction_type='receive_money', then=Value('debit')), default=Value('credit')),
+        counterparty_id=F('user_id'),
+    )
+    return _stream(queryset, position, limit)
+
+
+def activity_feed(user, cursor=None, limit=50):
+    """
+    سجل موحد (مرسلة + مستلمة) بدمج k-way لتيارين مرتبين بالمفتاح (timestamp, id).
+    كل تيار استعلام LIMIT على فهرسه، بدل OR على عمودين لا يستخدم أي فهرس.
+    تُرجع (المعاملات, مؤشر الصفحة التالية أو None).
+    """
+    position = decode_cursor(cursor) if cursor else None
+    streams = [
+        sent_stream(user, position, limit + 1),
+        received_stream(user, position, limit + 1),
+    ]
+    merged = heapq.merge(*streams, key=_sort_key, reverse=True)
+    items = [item for _, item in zip(range(limit + 1), merged)]
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1])
+    return items, next_cursor
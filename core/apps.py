@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # تسجيل إشارات مزامنة فهرس المندوبين
+        from . import dispatch  # noqa: F401
+
+        # تحميل لقطة أسعار الصرف ومصفوفة الأزواج (إن وُجدتا) مرة واحدة عند الإقلاع
+        from .rate_matrix import load_matrix
+        from .rates import load_snapshot
+        load_snapshot()
+        load_matrix()
@@ -0,0 +1,199 @@
+# core/assignment.py
+
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import User, Transaction, DeliveryLocation
+from .geo import haversine_matrix
+from .dispatch import agent_score
+from .eta import agent_speeds
+
+# تكلفة تمثل إسنادًا غير مسموح (أبعد من DISPATCH_MAX_DISTANCE_KM)
+INFEASIBLE_COST = 1e9
+
+
+def linear_sum_assignment(cost):
+    """
+    حل مسألة الإسناد بأقل تكلفة (الخوارزمية الهنغارية، O(n²m)).
+    تعمل على مصفوفات مستطيلة وتُرجع (rows, cols) مثل scipy.optimize.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)    # p[j]: الصف المسند للعمود j (0 = لا شيء)
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = np.nonzero(~used[1:])[0] + 1
+            reduced = cost[i0 - 1, free - 1] - u[i0] - v[free]
+            better = reduced < minv[free]
+            minv[free[better]] = reduced[better]
+            way[free[better]] = j0
+
+            j1 = free[np.argmin(minv[free])]
+            delta = minv[j1]
+            visited = np.nonzero(used)[0]
+            u[p[visited]] += delta
+            v[visited] -= delta
+            minv[free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # عكس مسار الزيادة
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[cols + 1] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def _window_transactions(day, start, end):
+    queryset = Transaction.objects.filter(
+        delivery_type='scheduled',
+        delivery_agent__isnull=True,
+        delivery_date=day,
+        delivery_time__gte=start,
+        recipient_latitude__isnull=False,
+        recipient_longitude__isnull=False,
+    )
+    if end is not None:
+        queryset = queryset.filter(delivery_time__lt=end)
+    return list(queryset.only('id', 'recipient_latitude', 'recipient_longitude'))
+
+
+def _available_agents():
+    # المندوبون الموثقون الذين لديهم موقع، مع حملهم الحالي
+    return list(
+        DeliveryLocation.objects.filter(delivery_agent__status='verified').values_list(
+            'delivery_agent_id', 'latitude', 'longitude', 'delivery_agent__active_deliveries'
+        )
+    )
+
+
+def assign_window(day, start, end=None, capacity=None, dry_run=False):
+    """
+    إسناد كل التسليمات المجدولة في نافذة زمنية واحدة دفعة واحدة.
+    كل مندوب يملك `capacity` خانات، وتكلفة الخانة j هي درجة المندوب
+    (المسافة + غرامة الحمل) بعد إضافة j تسليمات، ثم يُحل الإسناد
+    بأقل مجموع تكلفة ويُكتب بتحديث جماعي.
+    تُرجع قائمة [(transaction_id, agent_id, distance_km)].
+    """
+    transactions = _window_transactions(day, start, end)
+    agents = _available_agents()
+    if not transactions or not agents:
+        return []
+
+    if capacity is None:
+        capacity = getattr(settings, 'SCHEDULED_AGENT_CAPACITY', 3)
+    max_active = getattr(settings, 'DISPATCH_MAX_ACTIVE_DELIVERIES', None)
+
+    # خانات المندوبين: (agent_id, عمود المسافة, الحمل بعد الإسناد)
+    slots = []
+    for column, (agent_id, _, _, active) in enumerate(agents):
+        free = capacity if max_active is None else min(capacity, max_active - active)
+        for extra in range(max(free, 0)):
+            slots.append((agent_id, column, active + extra))
+    if not slots:
+        return []
+
+    distances = haversine_matrix(
+        [t.recipient_latitude for t in transactions],
+        [t.recipient_longitude for t in transactions],
+        [a[1] for a in agents],
+        [a[2] for a in agents],
+    )
+    slot_columns = np.array([slot[1] for slot in slots])
+    slot_loads = np.array([slot[2] for slot in slots], dtype=np.float64)
+    slot_distances = distances[:, slot_columns]
+    speeds = agent_speeds([slot[0] for slot in slots])
+    slot_speeds = np.array([speeds[slot[0]] for slot in slots], dtype=np.float64)
+    cost = agent_score(slot_distances, slot_loads[np.newaxis, :], slot_speeds[np.newaxis, :])
+
+    max_km = getattr(settings, 'DISPATCH_MAX_DISTANCE_KM', None)
+    if max_km is not None:
+        cost = np.where(slot_distances > max_km, INFEASIBLE_COST, cost)
+
+    rows, cols = linear_sum_assignment(cost)
+    assignments = [
+        (transactions[row].id, slots[col][0], float(slot_distances[row, col]))
+        for row, col in zip(rows, cols)
+        if cost[row, col] < INFEASIBLE_COST
+    ]
+
+    if assignments and not dry_run:
+        applied = _apply(assignments)
+        assignments = [assignment for assignment in assignments if assignment[0] in applied]
+    return assignments
+
+
+def _apply(assignments):
+    """
+    حفظ الإسناد للمعاملات التي ما زالت بدون مندوب. تُرجع ids المعاملات التي أُسندت فعلًا.
+    """
+    agent_by_transaction = {transaction_id: agent_id for transaction_id, agent_id, _ in assignments}
+
+    with db_transaction.atomic():
+        # لا نلمس إلا المعاملات التي ما زالت بدون مندوب، مقفلة حتى التحديث:
+        # الإسناد المتزامن (assign_to_me أو best_agent) إما ينتظرنا أو يُستبعد صفه هنا
+        updatable = Transaction.objects.select_for_update().filter(
+            id__in=agent_by_transaction.keys(), delivery_agent__isnull=True
+        ).only('id')
+        to_update = []
+        for transaction in updatable:
+            transaction.delivery_agent_id = agent_by_transaction[transaction.id]
+            transaction.delivery_status = 'assigned'
+            to_update.append(transaction)
+        Transaction.objects.bulk_update(to_update, ['delivery_agent', 'delivery_status'])
+
+        loads = Counter(t.delivery_agent_id for t in to_update)
+        if loads:
+            User.objects.filter(id__in=loads.keys()).update(
+                active_deliveries=F('active_deliveries') + Case(
+                    *[When(id=agent_id, then=Value(count)) for agent_id, count in loads.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+    return {t.id for t in to_update}
+
+
+def iter_windows(day, days=1, window_minutes=60):
+    """
+    تقسيم الأيام المطلوبة إلى نوافذ زمنية متتالية: (day, start, end).
+    end = None تعني حتى نهاية اليوم.
+    """
+    step = timedelta(minutes=window_minutes)
+    for offset in range(days):
+        current_day = day + timedelta(days=offset)
+        start = datetime.combine(current_day, time.min)
+        end_of_day = start + timedelta(days=1)
+        while start < end_of_day:
+            end = start + step
+            yield current_day, start.time(), (end.time() if end < end_of_day else None)
+            start = end
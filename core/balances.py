@@ -0,0 +1,166 @@
+# core/balances.py
+
+import random
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .models import User, CardDetail, BalanceShard
+
+
+class InsufficientFunds(serializers.ValidationError):
+    """
+    الرصيد غير كافٍ للخصم (أو الحساب غير موجود). ترث من ValidationError
+    حتى تُرجع 400 وتُلغي المعاملة (atomic) المحيطة بدون معالجة إضافية.
+    """
+
+
+# كل عملية هنا استعلام UPDATE واحد مشروط: لا قراءة قبل الكتابة،
+# والشرط balance >= amount داخل نفس الاستعلام يمنع ضياع التحديثات المتزامنة.
+
+def debit_wallet(user_id, amount, sharded=False):
+    """
+    خصم من محفظة المستخدم: UPDATE ... WHERE id = ? AND total_balance >= amount.
+    تُرجع True إذا تم الخصم (صف واحد متأثر).
+    للحسابات المجزأة: عند عدم كفاية الرصيد الأساسي تُدمج الأرصدة الفرعية ثم يُعاد الخصم مرة واحدة.
+    """
+    debited = User.objects.filter(id=user_id, total_balance__gte=amount).update(
+        total_balance=F('total_balance') - amount
+    ) == 1
+    if not debited and sharded and compact_shards(user_id):
+        return debit_wallet(user_id, amount)
+    return debited
+
+
+def credit_wallet(user_id, amount, sharded=False):
+    if sharded:
+        return credit_shard(user_id, amount)
+    return User.objects.filter(id=user_id).update(
+        total_balance=F('total_balance') + amount
+    ) == 1
+
+
+def credit_wallets(amounts, sharded_ids=()):
+    """
+    إيداع جماعي: {user_id: amount} باستعلام UPDATE واحد (CASE WHEN) بدل استعلام لكل مستخدم.
+    الحسابات المجزأة (sharded_ids) تُودع في أرصدتها الفرعية.
+    """
+    plain = {user_id: amount for user_id, amount in amounts.items() if user_id not in sharded_ids}
+    if plain:
+        User.objects.filter(id__in=plain.keys()).update(
+            total_balance=F('total_balance') + Case(
+                *[When(id=user_id, then=Value(amount)) for user_id, amount in plain.items()],
+                default=Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+    for user_id in sharded_ids:
+        if user_id in amounts:
+            credit_shard(user_id, amounts[user_id])
+
+
+# --- الأرصدة الفرعية (BalanceShard) ---
+# الإيداع في حساب ساخن يحدّث واحدًا من BALANCE_SHARDS صفوف عشوائيًا بدل صف المستخدم،
+# فلا تتسلسل التحويلات المتزامنة على قفل صف واحد.
+
+def credit_shard(user_id, amount):
+    shard = random.randrange(getattr(settings, 'BALANCE_SHARDS', 8))
+    updated = BalanceShard.objects.filter(user_id=user_id, shard=shard).update(
+        balance=F('balance') + amount
+    )
+    if not updated:
+        # أول إيداع: إنشاء كل الصفوف الفرعية مرة واحدة
+        BalanceShard.objects.bulk_create([
+            BalanceShard(user_id=user_id, shard=number)
+            for number in range(getattr(settings, 'BALANCE_SHARDS', 8))
+        ], ignore_conflicts=True)
+        updated = BalanceShard.objects.filter(user_id=user_id, shard=shard).update(
+            balance=F('balance') + amount
+        )
+    return updated == 1
+
+
+def compact_shards(user_id):
+    """
+    دمج الأرصدة الفرعية في total_balance. تُرجع المبلغ المدموج.
+    """
+    with db_transaction.atomic():
+        shards = list(
+            BalanceShard.objects.select_for_update()
+            .filter(user_id=user_id)
+            .exclude(balance=0)
+            .values_list('id', 'balance')
+        )
+        total = sum(balance for _, balance in shards)
+        if shards:
+            BalanceShard.objects.filter(id__in=[pk for pk, _ in shards]).update(balance=0)
+            User.objects.filter(id=user_id).update(total_balance=F('total_balance') + total)
+    return total
+
+
+def wallet_balance(user_id, sharded=False):
+    """
+    رصيد المحفظة الفعلي (الأساسي + الأرصدة الفرعية غير المدموجة).
+    """
+    balance = User.objects.filter(id=user_id).values_list('total_balance', flat=True).first()
+    if balance is not None and sharded:
+        pending = BalanceShard.objects.filter(user_id=user_id).aggregate(total=Sum('balance'))['total']
+        balance += pending or 0
+    return balance
+
+
+def debit_card(card_id, amount, user_id=None):
+    """
+    خصم من رصيد البطاقة. مع user_id يُشترط أن تخص البطاقة المستخدم.
+    """
+    cards = CardDetail.objects.filter(id=card_id, balance__gte=amount)
+    if user_id is not None:
+        cards = cards.filter(user_id=user_id)
+    return cards.update(balance=F('balance') - amount) == 1
+
+
+def credit_card(card_id, amount, user_id=None):
+    cards = CardDetail.objects.filter(id=card_id)
+    if user_id is not None:
+        cards = cards.filter(user_id=user_id)
+    # رصيد البطاقة قد يكون NULL
+    return cards.update(balance=Coalesce(F('balance'), Value(0)) + amount) == 1
+
+
+# --- نسخ تُطلق InsufficientFunds مع رسالة واضحة عند الفشل ---
+# القراءة الإضافية تحدث فقط في مسار الفشل لتحديد السبب.
+# error_key يحدد شكل جسم الخطأ كما يتوقعه كل endpoint: {"error": "..."} افتراضيًا،
+# أو {"non_field_errors": ["..."]} كأخطاء validate() في مسار المحفظة.
+
+def _failure(message, error_key):
+    if error_key == api_settings.NON_FIELD_ERRORS_KEY:
+        return InsufficientFunds({error_key: [message]})
+    return InsufficientFunds({error_key: message})
+
+
+def withdraw_wallet(user_id, amount, currency='', sharded=False, error_key='error'):
+    if not debit_wallet(user_id, amount, sharded=sharded):
+        balance = wallet_balance(user_id, sharded=sharded)
+        if balance is None:
+            raise _failure("المستخدم غير موجود.", error_key)
+        raise _failure(f"رصيد المحفظة غير كافٍ. الرصيد الحالي: {balance} {currency}".strip(), error_key)
+
+
+def withdraw_card(card_id, amount, user_id=None, currency='', error_key='error'):
+    if not debit_card(card_id, amount, user_id=user_id):
+        cards = CardDetail.objects.filter(id=card_id)
+        if user_id is not None:
+            cards = cards.filter(user_id=user_id)
+        row = cards.values_list('balance').first()
+        if row is None:
+            raise _failure("البطاقة غير موجودة أو لا تخصك.", error_key)
+        raise _failure(f"رصيد البطاقة غير كافٍ. الرصيد الحالي: {row[0]} {currency}".strip(), error_key)
+
+
+def deposit_card(card_id, amount, user_id=None, error_key='error'):
+    if not credit_card(card_id, amount, user_id=user_id):
+        raise _failure("البطاقة غير موجودة أو لا تخصك.", error_key)
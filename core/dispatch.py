@@ -0,0 +1,349 @@
+# core/dispatch.py
+
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import User, DeliveryLocation
+from .geo import haversine_many, EARTH_RADIUS_KM
+from . import eta
+
+logger = logging.getLogger(__name__)
+
+# طول درجة واحدة على خط الطول بالكيلومتر
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# حالات التسليم التي تُحتسب ضمن حمل المندوب
+ACTIVE_DELIVERY_STATUSES = ('assigned', 'in_transit')
+
+
+class AgentGridIndex:
+    """
+    فهرس شبكي (grid) لمواقع المندوبين.
+    تُقسَّم الخريطة إلى خلايا ثابتة الحجم (بالدرجات)، ويتم البحث عن الأقرب
+    بتوسيع حلقات الخلايا حول نقطة الطلب بدل المرور على جميع المندوبين.
+    """
+
+    def __init__(self, cell_size_deg=0.05):
+        self.cell_size = cell_size_deg
+        self._cells = defaultdict(dict)  # (row, col) -> {agent_id: (lat, lng)}
+        self._agents = {}                # agent_id -> (lat, lng, cell)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._agents)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def upsert(self, agent_id, lat, lng):
+        lat, lng = float(lat), float(lng)
+        cell = self._cell(lat, lng)
+        with self._lock:
+            old = self._agents.get(agent_id)
+            if old is not None and old[2] != cell:
+                self._discard(agent_id, old[2])
+            self._cells[cell][agent_id] = (lat, lng)
+            self._agents[agent_id] = (lat, lng, cell)
+
+    def remove(self, agent_id):
+        with self._lock:
+            old = self._agents.pop(agent_id, None)
+            if old is not None:
+                self._discard(agent_id, old[2])
+
+    def _discard(self, agent_id, cell):
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(agent_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def _ring(self, row, col, ring):
+        # الخلايا الواقعة على حافة المربع ذي نصف القطر `ring`
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
+    def _lower_bound_km(self, lat, ring):
+        # أقل مسافة ممكنة لأي مندوب خارج الحلقات التي تم فحصها
+        far_lat = min(abs(lat) + (ring + 1) * self.cell_size, 89.0)
+        return ring * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(far_lat))
+
+    def nearest(self, lat, lng, k=1, max_km=None):
+        """
+        إرجاع أقرب k مندوبين كقائمة [(agent_id, distance_km)] مرتبة تصاعديًا.
+        """
+        lat, lng = float(lat), float(lng)
+        row, col = self._cell(lat, lng)
+        found = []
+
+        def collect(buckets):
+            # حساب مسافات كل مندوبي الحلقة باستدعاء متجهي واحد
+            ids, lats, lngs = [], [], []
+            for bucket in buckets:
+                for agent_id, (a_lat, a_lng) in bucket.items():
+                    ids.append(agent_id)
+                    lats.append(a_lat)
+                    lngs.append(a_lng)
+            if ids:
+                found.extend(zip(haversine_many(lat, lng, lats, lngs).tolist(), ids))
+
+        with self._lock:
+            ring = 0
+            while self._cells:
+                if (2 * ring + 1) ** 2 >= len(self._cells):
+                    # عدد خلايا الحلقة تجاوز الخلايا المشغولة: نفحص الباقي مباشرة
+                    collect(
+                        bucket for (r, c), bucket in self._cells.items()
+                        if max(abs(r - row), abs(c - col)) >= ring
+                    )
+                    break
+
+                collect(
+                    self._cells[cell] for cell in self._ring(row, col, ring)
+                    if cell in self._cells
+                )
+
+                bound = self._lower_bound_km(lat, ring)
+                if max_km is not None and bound > max_km:
+                    break
+                if len(found) >= k and sorted(found)[k - 1][0] <= bound:
+                    break
+                ring += 1
+
+        found.sort()
+        if max_km is not None:
+            found = [item for item in found if item[0] <= max_km]
+        return [(agent_id, distance) for distance, agent_id in found[:k]]
+
+
+_index = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+
+
+def build_index():
+    """
+    بناء الفهرس من جدول DeliveryLocation (قراءة أعمدة الإحداثيات فقط)،
+    ثم تغطيته بمواقع المخزن الساخن الأحدث: الموجودة في الكاش، وما لم يُفرَّغ
+    بعد من هذه العملية (مندوب أرسل موقعه للتو قد لا يكون في الجدول إطلاقًا).
+    """
+    from .locations import location_store
+
+    latest = {
+        agent_id: (lat, lng, updated_at)
+        for agent_id, lat, lng, updated_at in DeliveryLocation.objects.values_list(
+            'delivery_agent_id', 'latitude', 'longitude', 'updated_at'
+        ).iterator()
+    }
+    for position in location_store.cached(latest.keys()) + location_store.pending():
+        current = latest.get(position.agent_id)
+        if current is None or current[2] <= position.updated_at:
+            latest[position.agent_id] = (position.latitude, position.longitude, position.updated_at)
+
+    index = AgentGridIndex(getattr(settings, 'DISPATCH_GRID_CELL_DEG', 0.05))
+    for agent_id, (lat, lng, _) in latest.items():
+        index.upsert(agent_id, lat, lng)
+    return index
+
+
+def _rebuild_in_background():
+    # إعادة بناء واحدة فقط في نفس الوقت، والطلبات تكمل على الفهرس الحالي
+    if not _build_lock.acquire(blocking=False):
+        return
+
+    def run():
+        global _index, _built_at
+        try:
+            _index = build_index()
+        except Exception:
+            logger.exception("تعذر إعادة بناء فهرس المندوبين")
+        finally:
+            _built_at = time.monotonic()
+            _build_lock.release()
+            connection.close()
+
+    threading.Thread(target=run, name='dispatch-index-rebuild', daemon=True).start()
+
+
+def get_index():
+    """
+    الفهرس المشترك داخل العملية. يُبنى مرة واحدة عند أول استخدام، وبعد انتهاء
+    DISPATCH_INDEX_TTL ثانية يُعاد بناؤه في الخلفية لالتقاط تحديثات العمليات (workers)
+    الأخرى، فلا يمر أي طلب على جدول DeliveryLocation كاملًا.
+    """
+    global _index, _built_at
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _index = build_index()
+                _built_at = time.monotonic()
+    elif time.monotonic() - _built_at > getattr(settings, 'DISPATCH_INDEX_TTL', 60):
+        _rebuild_in_background()
+    return _index
+
+
+def nearest_in_bbox(lat, lng, k=1, max_km=None):
+    """
+    البحث في قاعدة البيانات بصندوق إحداثيات حول النقطة (على أعمدة مفهرسة)،
+    ثم حساب المسافة الدقيقة للمرشحين فقط. يتسع الصندوق تدريجيًا (×2)
+    إذا لم يُعثر على k مندوبين داخل نصف القطر الحالي.
+    """
+    lat, lng = float(lat), float(lng)
+    radius = getattr(settings, 'DISPATCH_BBOX_INITIAL_KM', 5)
+    limit = max_km if max_km is not None else getattr(settings, 'DISPATCH_BBOX_MAX_KM', 20000)
+
+    while True:
+        radius = min(radius, limit)
+        dlat = radius / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 89.0)))
+        dlng = radius / (KM_PER_DEGREE * cos_lat)
+
+        rows = DeliveryLocation.objects.filter(
+            latitude__range=(max(lat - dlat, -90), min(lat + dlat, 90))
+        )
+        if dlng < 180:
+            rows = rows.filter(longitude__range=(lng - dlng, lng + dlng))
+        rows = list(rows.values_list('delivery_agent_id', 'latitude', 'longitude'))
+
+        found = []
+        if rows:
+            ids, lats, lngs = zip(*rows)
+            distances = haversine_many(lat, lng, lats, lngs).tolist()
+            # فقط من هم داخل الدائرة مضمون أنهم الأقرب
+            found = sorted(
+                (distance, agent_id)
+                for distance, agent_id in zip(distances, ids)
+                if distance <= radius
+            )
+
+        if len(found) >= k or radius >= limit:
+            return [(agent_id, distance) for distance, agent_id in found[:k]]
+        radius *= 2
+
+
+def _nearest_candidates(lat, lng, k, max_km):
+    if getattr(settings, 'DISPATCH_SEARCH_MODE', 'grid') == 'bbox':
+        return nearest_in_bbox(lat, lng, k=k, max_km=max_km)
+    return get_index().nearest(lat, lng, k=k, max_km=max_km)
+
+
+def nearest_agents(lat, lng, k=1, max_km=None):
+    """
+    إرجاع أقرب k مندوبين موثقين كقائمة [(agent, distance_km)].
+    """
+    if max_km is None:
+        max_km = getattr(settings, 'DISPATCH_MAX_DISTANCE_KM', None)
+
+    want = k
+    while True:
+        candidates = _nearest_candidates(lat, lng, want, max_km)
+        # استعلام واحد صغير للتحقق من أن المرشحين ما زالوا موثقين
+        agents = User.objects.filter(
+            id__in=[agent_id for agent_id, _ in candidates],
+            status='verified'
+        ).in_bulk()
+        result = [
+            (agents[agent_id], distance)
+            for agent_id, distance in candidates
+            if agent_id in agents
+        ]
+        if len(result) >= k or len(candidates) < want:
+            return result[:k]
+        want *= 2
+
+
+def closest_agent(lat, lng):
+    """
+    أقرب مندوب موثق للنقطة (lat, lng)، أو None.
+    """
+    agents = nearest_agents(lat, lng, k=1)
+    return agents[0][0] if agents else None
+
+
+def agent_score(distance_km, active_deliveries, speed_kmh=None):
+    """
+    درجة المندوب (الأقل أفضل): المسافة + غرامة ثابتة بالكيلومتر لكل تسليم نشط.
+    مع speed_kmh تُحوَّل المسافة إلى ما يعادلها بالسرعة الافتراضية،
+    فالمندوب الأسرع فعليًا يبدو أقرب.
+    """
+    if speed_kmh is not None:
+        distance_km = distance_km * eta.default_speed() / speed_kmh
+    penalty = getattr(settings, 'DISPATCH_LOAD_PENALTY_KM', 2.0)
+    return distance_km + penalty * active_deliveries
+
+
+def best_agent(lat, lng):
+    """
+    اختيار المندوب الأنسب من بين أقرب DISPATCH_CANDIDATES مندوبين
+    بناءً على المسافة والحمل الحالي (العدادات تُقرأ مع المرشحين بدون COUNT)
+    والسرعة الفعلية الحديثة لكل مندوب (قراءة واحدة من الكاش).
+    """
+    candidates = nearest_agents(lat, lng, k=getattr(settings, 'DISPATCH_CANDIDATES', 10))
+    max_active = getattr(settings, 'DISPATCH_MAX_ACTIVE_DELIVERIES', None)
+    if max_active is not None:
+        candidates = [
+            (agent, distance) for agent, distance in candidates
+            if agent.active_deliveries < max_active
+        ]
+    if not candidates:
+        return None
+    speeds = eta.agent_speeds([agent.id for agent, _ in candidates])
+    agent, _ = min(
+        candidates,
+        key=lambda item: agent_score(item[1], item[0].active_deliveries, speeds[item[0].id])
+    )
+    return agent
+
+
+def increment_workload(agent_id, by=1):
+    """
+    زيادة عداد التسليمات النشطة للمندوب عند الإسناد.
+    """
+    if agent_id:
+        User.objects.filter(pk=agent_id).update(active_deliveries=F('active_deliveries') + by)
+
+
+def decrement_workload(agent_id, by=1):
+    """
+    إنقاص العداد عند إكمال التسليم (بدون النزول تحت الصفر).
+    """
+    if agent_id:
+        User.objects.filter(pk=agent_id, active_deliveries__gte=by).update(
+            active_deliveries=F('active_deliveries') - by
+        )
+
+
+def update_agent_position(agent_id, lat, lng):
+    """
+    تحديث موقع مندوب في الفهرس فورًا (إن كان الفهرس مبنيًا في هذه العملية).
+    """
+    if _index is not None:
+        _index.upsert(agent_id, lat, lng)
+
+
+# --- مزامنة الفهرس مع تغييرات المواقع داخل نفس العملية ---
+@receiver(post_save, sender=DeliveryLocation)
+def _location_saved(sender, instance, **kwargs):
+    update_agent_position(instance.delivery_agent_id, instance.latitude, instance.longitude)
+
+
+@receiver(post_delete, sender=DeliveryLocation)
+def _location_deleted(sender, instance, **kwargs):
+    if _index is not None:
+        _index.remove(instance.delivery_agent_id)
@@ -0,0 +1,96 @@
+# core/eta.py
+
+import math
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .geo import haversine_distance
+
+# ملخص متحرك لسرعة المندوب: آخر نقطة + متوسط أُسّي للسرعة (EWMA)
+SpeedSummary = namedtuple('SpeedSummary', ['latitude', 'longitude', 'at', 'speed_kmh', 'samples'])
+
+
+def _cache_key(agent_id):
+    return f"agent_speed_{agent_id}"
+
+
+def _summary_timeout():
+    return getattr(settings, 'ETA_SUMMARY_TTL', 6 * 3600)
+
+
+def default_speed():
+    return getattr(settings, 'DELIVERY_AVERAGE_SPEED_KMH', 36)
+
+
+def update_speed(summary, latitude, longitude, at):
+    """
+    تحديث الملخص بنقطة جديدة في O(1).
+    وزن النقطة يعتمد على الزمن منذ النقطة السابقة (نافذة متحركة بنصف عمر
+    ETA_SPEED_HALF_LIFE ثانية)، والقفزات غير الواقعية تُتجاهل.
+    """
+    if summary is None:
+        return SpeedSummary(latitude, longitude, at, None, 0)
+
+    seconds = (at - summary.at).total_seconds()
+    if seconds <= 0:
+        # نقطة قديمة أو مكررة: لا تغيّر الملخص
+        return summary
+
+    distance = haversine_distance(
+        float(summary.latitude), float(summary.longitude), float(latitude), float(longitude)
+    )
+    speed = distance / (seconds / 3600)
+    if speed > getattr(settings, 'ETA_MAX_SPEED_KMH', 160):
+        # قفزة GPS: نحدّث النقطة فقط
+        return summary._replace(latitude=latitude, longitude=longitude, at=at)
+
+    half_life = getattr(settings, 'ETA_SPEED_HALF_LIFE', 600)
+    weight = 1 - math.exp(-seconds * math.log(2) / half_life)
+    if summary.speed_kmh is None:
+        average = speed
+    else:
+        average = summary.speed_kmh + weight * (speed - summary.speed_kmh)
+
+    return SpeedSummary(latitude, longitude, at, average, summary.samples + 1)
+
+
+def observe(agent_id, positions):
+    """
+    تمرير نقاط جديدة (مرتبة زمنيًا) للمندوب وتحديث ملخصه في الكاش.
+    """
+    summary = cache.get(_cache_key(agent_id))
+    for position in positions:
+        summary = update_speed(summary, position.latitude, position.longitude, position.updated_at)
+    cache.set(_cache_key(agent_id), summary, timeout=_summary_timeout())
+    return summary
+
+
+def agent_speeds(agent_ids):
+    """
+    السرعة الفعلية الحديثة لعدة مندوبين بقراءة واحدة من الكاش: {agent_id: km/h}.
+    المندوب بدون عينات كافية يأخذ السرعة الافتراضية.
+    """
+    keys = {_cache_key(agent_id): agent_id for agent_id in agent_ids}
+    summaries = cache.get_many(keys.keys())
+    min_samples = getattr(settings, 'ETA_MIN_SAMPLES', 3)
+    min_speed = getattr(settings, 'ETA_MIN_SPEED_KMH', 10)
+
+    speeds = {}
+    for key, agent_id in keys.items():
+        summary = summaries.get(key)
+        if summary is None or summary.speed_kmh is None or summary.samples < min_samples:
+            speeds[agent_id] = default_speed()
+        else:
+            # المندوب المتوقف مؤقتًا لا يعني أن الوقت المتوقع لا نهائي
+            speeds[agent_id] = max(summary.speed_kmh, min_speed)
+    return speeds
+
+
+def agent_speed(agent_id):
+    return agent_speeds([agent_id])[agent_id]
+
+
+def eta_minutes(distance_km, speed_kmh):
+    return distance_km / speed_kmh * 60
@@ -0,0 +1,65 @@
+# core/geo.py
+
+import math
+
+import numpy as np
+
+
+# نصف قطر الأرض بالكيلومتر
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    حساب المسافة بين نقطتين (lat, lon) بالكيلومتر.
+    """
+    R = EARTH_RADIUS_KM
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return R * c
+
+
+def _radians(values):
+    # يقبل قوائم Decimal أو float أو مصفوفات NumPy
+    return np.radians(np.asarray(values, dtype=np.float64))
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """
+    المسافات (كم) من نقطة واحدة إلى مصفوفة نقاط في استدعاء واحد.
+    تُرجع مصفوفة NumPy بنفس طول lats/lngs.
+    """
+    phi = math.radians(float(lat))
+    lam = math.radians(float(lng))
+    phis = _radians(lats)
+    lams = _radians(lngs)
+
+    a = np.sin((phis - phi) / 2) ** 2 + \
+        math.cos(phi) * np.cos(phis) * np.sin((lams - lam) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lats1, lngs1, lats2, lngs2):
+    """
+    مصفوفة المسافات (كم) بين عدة نقاط بداية وعدة نقاط نهاية.
+    الناتج بالشكل (len(lats1), len(lats2)).
+    """
+    phi1 = _radians(lats1)[:, np.newaxis]
+    lam1 = _radians(lngs1)[:, np.newaxis]
+    phi2 = _radians(lats2)[np.newaxis, :]
+    lam2 = _radians(lngs2)[np.newaxis, :]
+
+    a = np.sin((phi2 - phi1) / 2) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -0,0 +1,101 @@
+# core/idempotency.py
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+RUNNING = 'running'
+DONE = 'done'
+
+
+def _cache_key(request, key):
+    # المفتاح خاص بصاحب الطلب والمسار: نفس المفتاح من مستخدمَين لا يتصادم
+    if request.user and request.user.is_authenticated:
+        owner = f"user:{request.user.pk}"
+    else:
+        owner = f"guest:{request.headers.get('X-Guest-Token', '')}"
+    digest = hashlib.sha256(f"{owner}|{request.path}|{key}".encode()).hexdigest()
+    return f"idempotency_{digest}"
+
+
+def _fingerprint(request):
+    return hashlib.sha256(request.method.encode() + b'|' + request.body).hexdigest()
+
+
+def _replay(record):
+    response = Response(record['data'], status=record['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _store(cache_key, fingerprint, status_code, data):
+    cache.set(
+        cache_key,
+        {'state': DONE, 'fingerprint': fingerprint, 'status': status_code, 'data': data},
+        timeout=getattr(settings, 'IDEMPOTENCY_TTL', 24 * 3600)
+    )
+
+
+def idempotent(handler):
+    """
+    طبقة Idempotency-Key لنقاط الأموال (post في APIView).
+    - أول طلب بالمفتاح يحجزه بـ cache.add وينفذ، ثم تُحفظ الاستجابة مع بصمة الطلب.
+    - الطلب المكرر أثناء التنفيذ ينتظر النتيجة بدل إعادة التنفيذ.
+    - الطلب المكرر بعد الاكتمال يُرجع الاستجابة المحفوظة من الكاش مباشرة.
+    - نفس المفتاح مع بيانات مختلفة يُرفض (422).
+    الاستجابة تُحفظ بمجرد أن يُرجعها المعالج (ما نفذه ثُبِّت بالفعل)، حتى لو انقطع العميل بعدها.
+    الاستثناء وحده يحرر المفتاح (لم يُثبَّت شيء)، فيمكن إعادة المحاولة بنفس المفتاح.
+    المعالج يجب أن يُرجع Response (وليس بثًا) حتى تُحفظ نتيجته كاملة.
+    يتطلب كاشًا مشتركًا بين العمليات (Redis/Memcached) في الإنتاج.
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        wait_seconds = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+        poll_interval = getattr(settings, 'IDEMPOTENCY_POLL_INTERVAL', 0.1)
+        deadline = time.monotonic() + wait_seconds
+
+        while True:
+            record = cache.get(cache_key)
+            if record is not None and record['fingerprint'] != fingerprint:
+                return Response(
+                    {"error": "مفتاح Idempotency-Key مستخدم مسبقًا لطلب مختلف."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record is not None and record['state'] == DONE:
+                return _replay(record)
+
+            if record is None:
+                running = {'state': RUNNING, 'fingerprint': fingerprint}
+                # الحجز ينتهي تلقائيًا إن توقفت العملية المنفذة
+                if cache.add(cache_key, running, timeout=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 300)):
+                    break
+
+            if time.monotonic() >= deadline:
+                return Response(
+                    {"error": "طلب بنفس Idempotency-Key ما زال قيد التنفيذ، أعد المحاولة لاحقًا."},
+                    status=status.HTTP_409_CONFLICT
+                )
+            time.sleep(poll_interval)
+
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        _store(cache_key, fingerprint, response.status_code, response.data)
+        return response
+
+    return wrapper
@@ -0,0 +1,109 @@
+# core/ledger.py
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .models import LedgerEntry, BalanceSnapshot
+
+# الدفتر سجل تدقيق وأرصدة تاريخية (balance_as_of) بجانب أعمدة الرصيد، وليس بديلًا عنها:
+# User.total_balance و CardDetail.balance يبقيان مصدر الرصيد الحالي ويُحدَّثان بـ UPDATE
+# مشروط (core/balances.py) لأن فحص كفاية الرصيد يحتاج صفًا واحدًا يُقفل.
+
+# حسابات النظام (الطرف المقابل للنقد الداخل/الخارج والعمولات)
+CASH = 'system:cash'
+FEES = 'system:fees'
+OPENING = 'system:opening'
+
+
+def wallet_account(user_id):
+    return f"wallet:{user_id}"
+
+
+def card_account(card_id):
+    return f"card:{card_id}"
+
+
+class UnbalancedEntries(ValueError):
+    pass
+
+
+def post(legs, transaction=None, at=None):
+    """
+    تسجيل حركة مالية كقيود مزدوجة بعملية bulk_create واحدة.
+    legs: [(account, amount)] ومجموعها يجب أن يساوي صفرًا.
+    القيد قد يحمل معاملته الخاصة: (account, amount, transaction) للعمليات الجماعية.
+    تُستدعى داخل نفس المعاملة (atomic) التي تغيّر الأرصدة.
+    """
+    legs = [
+        (leg[0], Decimal(leg[1]), leg[2] if len(leg) > 2 else transaction)
+        for leg in legs if leg[1]
+    ]
+    if sum(amount for _, amount, _ in legs) != 0:
+        raise UnbalancedEntries(f"قيود غير متوازنة: {legs}")
+
+    at = at or timezone.now()
+    return LedgerEntry.objects.bulk_create([
+        LedgerEntry(account=account, amount=amount, transaction=leg_transaction, created_at=at)
+        for account, amount, leg_transaction in legs
+    ])
+
+
+def transfer(source, destination, amount, transaction=None):
+    return post([(source, -amount), (destination, amount)], transaction=transaction)
+
+
+def balance_as_of(account, at=None):
+    """
+    رصيد الحساب عند وقت معين: آخر لقطة قبل الوقت + القيود بعدها فقط.
+    """
+    at = at or timezone.now()
+    snapshot = BalanceSnapshot.objects.filter(account=account, as_of__lte=at).order_by('-as_of').first()
+
+    entries = LedgerEntry.objects.filter(account=account, created_at__lte=at)
+    balance = Decimal('0')
+    if snapshot is not None:
+        entries = entries.filter(created_at__gt=snapshot.as_of)
+        balance = snapshot.balance
+
+    tail = entries.aggregate(total=Sum('amount'))['total']
+    return balance + (tail or 0)
+
+
+def take_snapshots(as_of=None):
+    """
+    لقطة جديدة لكل حساب تغيّر منذ آخر تشغيل.
+    كل تشغيل يغطي القيود في (آخر نقطة لقطة، as_of] بتجميع واحد حسب الحساب،
+    والحسابات التي لم تتغير تبقى لقطاتها القديمة صالحة.
+    نقطة اللقطة متأخرة LEDGER_SNAPSHOT_LAG ثانية عن الآن حتى لا تفوتها
+    قيود معاملات لم تُثبَّت (commit) بعد.
+    تُرجع عدد اللقطات المنشأة.
+    """
+    if as_of is None:
+        as_of = timezone.now() - timedelta(seconds=getattr(settings, 'LEDGER_SNAPSHOT_LAG', 60))
+
+    since = BalanceSnapshot.objects.aggregate(last=Max('as_of'))['last']
+    entries = LedgerEntry.objects.filter(created_at__lte=as_of)
+    if since is not None:
+        if as_of <= since:
+            return 0
+        entries = entries.filter(created_at__gt=since)
+
+    # آخر لقطة لكل حساب متغير تُقرأ بقراءة واحدة من الفهرس (account, -as_of) داخل نفس التجميع
+    latest = BalanceSnapshot.objects.filter(account=OuterRef('account')).order_by('-as_of').values('balance')[:1]
+    totals = list(
+        entries.values('account')
+        .annotate(total=Sum('amount'), previous=Subquery(latest))
+        .order_by()
+    )
+    if not totals:
+        return 0
+
+    BalanceSnapshot.objects.bulk_create([
+        BalanceSnapshot(account=row['account'], balance=(row['previous'] or 0) + row['total'], as_of=as_of)
+        for row in totals
+    ])
+    return len(totals)
@@ -0,0 +1,271 @@
+# core/locations.py
+
+import atexit
+import logging
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction as db_transaction
+from django.utils import timezone
+
+from .models import DeliveryLocation, DeliveryLocationHistory
+from . import dispatch, eta
+from .tracking import broadcaster
+
+logger = logging.getLogger(__name__)
+
+# موقع المندوب كما يُقرأ من المخزن الساخن (نفس حقول DeliveryLocation)
+AgentPosition = namedtuple('AgentPosition', ['agent_id', 'latitude', 'longitude', 'updated_at'])
+
+
+def _cache_key(agent_id):
+    return f"agent_location_{agent_id}"
+
+
+class LocationStore:
+    """
+    مخزن ساخن لمواقع المندوبين.
+    - كل نبضة GPS تُكتب فورًا في الكاش (المشترك بين العمليات) وفي فهرس التوزيع.
+    - آخر موقع لكل مندوب يُجمَّع في الذاكرة ويُكتب إلى DeliveryLocation
+      دفعة واحدة كل LOCATION_FLUSH_INTERVAL ثانية (write-behind).
+    - سجل مواقع مختصر (نقطة كل LOCATION_HISTORY_MIN_INTERVAL ثانية) يُكتب مع نفس التفريغ،
+      وملخص السرعة (core.eta) يُحدَّث مع كل نقطة.
+    """
+
+    def __init__(self):
+        self._dirty = {}  # agent_id -> AgentPosition (آخر موقع فقط)
+        self._history = []  # نقاط مختصرة بانتظار الإضافة إلى سجل المواقع
+        self._history_at = {}  # agent_id -> وقت آخر نقطة أُضيفت للسجل
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'LOCATION_FLUSH_INTERVAL', 5)
+
+    @property
+    def max_staleness(self):
+        return getattr(settings, 'LOCATION_MAX_STALENESS', 120)
+
+    def record(self, agent_id, latitude, longitude, at=None):
+        """
+        تسجيل موقع جديد للمندوب بدون أي كتابة متزامنة في قاعدة البيانات.
+        """
+        position = AgentPosition(
+            agent_id,
+            Decimal(str(latitude)),
+            Decimal(str(longitude)),
+            at or timezone.now()
+        )
+        self.publish(position)
+        eta.observe(agent_id, [position])
+
+        history_interval = getattr(settings, 'LOCATION_HISTORY_MIN_INTERVAL', 15)
+        with self._lock:
+            current = self._dirty.get(agent_id)
+            if current is None or current.updated_at <= position.updated_at:
+                self._dirty[agent_id] = position
+            # السجل مختصر: نقطة واحدة على الأكثر كل LOCATION_HISTORY_MIN_INTERVAL ثانية
+            last_history = self._history_at.get(agent_id)
+            if last_history is None or (position.updated_at - last_history).total_seconds() >= history_interval:
+                self._history.append(position)
+                self._history_at[agent_id] = position.updated_at
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+
+        self._ensure_flusher()
+        if due:
+            self.flush()
+        return position
+
+    def publish(self, position):
+        """
+        نشر موقع (محفوظ أو سيُحفظ) في الكاش وفهرس التوزيع وبثوث التتبع.
+        """
+        cache.set(_cache_key(position.agent_id), position, timeout=self.max_staleness)
+        dispatch.update_agent_position(position.agent_id, position.latitude, position.longitude)
+        broadcaster.publish(position)
+
+    def ingest(self, agent_id, points):
+        """
+        استقبال دفعة نقاط GPS مخزنة على جهاز المندوب.
+        points: قائمة قواميس (latitude, longitude, recorded_at).
+        كل النقاط تُضاف إلى السجل، وأحدثها فقط يصبح الموقع الحي،
+        والكل داخل معاملة واحدة بعمليات جماعية.
+        """
+        points = sorted(points, key=lambda point: point['recorded_at'])
+        eta.observe(agent_id, [
+            AgentPosition(agent_id, point['latitude'], point['longitude'], point['recorded_at'])
+            for point in points
+        ])
+        newest = points[-1]
+        position = AgentPosition(
+            agent_id, newest['latitude'], newest['longitude'], newest['recorded_at']
+        )
+
+        # الدفعات المتأخرة لا تُلغي موقعًا حيًا أحدث منها
+        current = self.get(agent_id)
+        is_live = current is None or current.updated_at <= position.updated_at
+
+        with db_transaction.atomic():
+            DeliveryLocationHistory.objects.bulk_create([
+                DeliveryLocationHistory(
+                    delivery_agent_id=agent_id,
+                    latitude=point['latitude'],
+                    longitude=point['longitude'],
+                    recorded_at=point['recorded_at']
+                )
+                for point in points
+            ])
+            if is_live:
+                updated = DeliveryLocation.objects.filter(delivery_agent_id=agent_id).update(
+                    latitude=position.latitude,
+                    longitude=position.longitude,
+                    updated_at=position.updated_at
+                )
+                if not updated:
+                    DeliveryLocation.objects.create(
+                        delivery_agent_id=agent_id,
+                        latitude=position.latitude,
+                        longitude=position.longitude
+                    )
+                    # auto_now يضع وقت الحفظ، بينما نريد وقت تسجيل النقطة
+                    DeliveryLocation.objects.filter(delivery_agent_id=agent_id).update(
+                        updated_at=position.updated_at
+                    )
+
+        if not is_live:
+            return current
+
+        with self._lock:
+            pending = self._dirty.get(agent_id)
+            if pending is not None and pending.updated_at <= position.updated_at:
+                del self._dirty[agent_id]
+        self.publish(position)
+        return position
+
+    def get(self, agent_id):
+        """
+        آخر موقع معروف للمندوب: من الكاش أولًا ثم من قاعدة البيانات.
+        """
+        position = cache.get(_cache_key(agent_id))
+        if position is not None:
+            return position
+
+        row = DeliveryLocation.objects.filter(delivery_agent_id=agent_id).values_list(
+            'latitude', 'longitude', 'updated_at'
+        ).first()
+        if row is None:
+            return None
+        position = AgentPosition(agent_id, *row)
+        cache.add(_cache_key(agent_id), position, timeout=self.max_staleness)
+        return position
+
+    def pending(self):
+        """
+        المواقع المسجلة في هذه العملية ولم تُكتب بعد إلى DeliveryLocation.
+        """
+        with self._lock:
+            return list(self._dirty.values())
+
+    def cached(self, agent_ids):
+        """
+        مواقع المندوبين الموجودة في الكاش (من كل العمليات) بقراءة get_many واحدة.
+        """
+        keys = {_cache_key(agent_id): agent_id for agent_id in agent_ids}
+        return list(cache.get_many(keys).values())
+
+    def flush(self):
+        """
+        كتابة آخر المواقع المتراكمة إلى DeliveryLocation بعمليات جماعية.
+        """
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            history, self._history = self._history, []
+            self._last_flush = time.monotonic()
+        if not pending and not history:
+            return 0
+
+        try:
+            with db_transaction.atomic():
+                if history:
+                    DeliveryLocationHistory.objects.bulk_create([
+                        DeliveryLocationHistory(
+                            delivery_agent_id=position.agent_id,
+                            latitude=position.latitude,
+                            longitude=position.longitude,
+                            recorded_at=position.updated_at
+                        )
+                        for position in history
+                    ])
+
+                existing = {
+                    location.delivery_agent_id: location
+                    for location in DeliveryLocation.objects.filter(
+                        delivery_agent_id__in=pending.keys()
+                    )
+                }
+
+                to_update, to_create = [], []
+                for agent_id, position in pending.items():
+                    location = existing.get(agent_id)
+                    if location is None:
+                        location = DeliveryLocation(delivery_agent_id=agent_id)
+                        to_create.append(location)
+                    else:
+                        to_update.append(location)
+                    location.latitude = position.latitude
+                    location.longitude = position.longitude
+                    location.updated_at = position.updated_at
+
+                if to_update:
+                    DeliveryLocation.objects.bulk_update(
+                        to_update, ['latitude', 'longitude', 'updated_at']
+                    )
+                if to_create:
+                    DeliveryLocation.objects.bulk_create(to_create)
+        except Exception:
+            # إعادة المواقع غير المكتوبة ما لم تصل مواقع أحدث منها
+            with self._lock:
+                for agent_id, position in pending.items():
+                    self._dirty.setdefault(agent_id, position)
+                self._history[:0] = history
+            raise
+
+        return len(pending)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(
+                    target=self._run, name='location-flusher', daemon=True
+                )
+                self._flusher.start()
+
+    def _run(self):
+        # تفريغ دوري حتى لو توقفت النبضات في هذه العملية
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("فشل تفريغ مواقع المندوبين")
+            finally:
+                close_old_connections()
+
+
+location_store = LocationStore()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        location_store.flush()
+    except Exception:
+        logger.exception("فشل تفريغ مواقع المندوبين عند الإغلاق")
@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.assignment import assign_window, iter_windows
+
+
+class Command(BaseCommand):
+    help = 'Jointly assigns delivery agents to scheduled transactions, one time window at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='اليوم الأول بصيغة YYYY-MM-DD (الافتراضي: اليوم)')
+        parser.add_argument('--days', type=int, default=1)
+        parser.add_argument('--window-minutes', type=int, default=60)
+        parser.add_argument('--capacity', type=int, default=None, help='أقصى عدد تسليمات للمندوب في النافذة')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError("صيغة التاريخ غير صحيحة، استخدم YYYY-MM-DD.")
+        else:
+            day = timezone.localdate()
+
+        total = 0
+        total_km = 0.0
+        for window_day, start, end in iter_windows(day, options['days'], options['window_minutes']):
+            assignments = assign_window(
+                window_day, start, end,
+                capacity=options['capacity'],
+                dry_run=options['dry_run']
+            )
+            if not assignments:
+                continue
+            window_km = sum(distance for _, _, distance in assignments)
+            total += len(assignments)
+            total_km += window_km
+            self.stdout.write(
+                f"{window_day} {start:%H:%M}-{end.strftime('%H:%M') if end else '24:00'}: "
+                f"{len(assignments)} assigned, {window_km:.2f} km"
+            )
+
+        prefix = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Assigned {total} scheduled deliveries, total distance {total_km:.2f} km"
+        ))
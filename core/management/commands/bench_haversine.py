@@ -0,0 +1,65 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.geo import haversine_distance, haversine_many, haversine_matrix
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the scalar haversine loop against the vectorized kernels'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+        parser.add_argument('--origins', type=int, default=100, help='عدد نقاط البداية في اختبار المصفوفة')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def _best(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        repeat = options['repeat']
+        lat, lng = 25.2048, 55.2708  # دبي
+
+        for size in options['sizes']:
+            lats = [rng.uniform(24.0, 26.0) for _ in range(size)]
+            lngs = [rng.uniform(54.0, 56.5) for _ in range(size)]
+
+            loop = self._best(
+                lambda: [haversine_distance(lat, lng, a, b) for a, b in zip(lats, lngs)],
+                repeat
+            )
+            vectorized = self._best(lambda: haversine_many(lat, lng, lats, lngs), repeat)
+
+            self.stdout.write(
+                f"{size:>7} agents | loop {loop * 1000:9.2f} ms | "
+                f"haversine_many {vectorized * 1000:8.2f} ms | x{loop / vectorized:.1f}"
+            )
+
+        # مصفوفة: عدة نقاط بداية × عدد مندوبين
+        origins = options['origins']
+        size = min(options['sizes'])
+        o_lats = [rng.uniform(24.0, 26.0) for _ in range(origins)]
+        o_lngs = [rng.uniform(54.0, 56.5) for _ in range(origins)]
+        lats = [rng.uniform(24.0, 26.0) for _ in range(size)]
+        lngs = [rng.uniform(54.0, 56.5) for _ in range(size)]
+
+        loop = self._best(
+            lambda: [
+                [haversine_distance(a, b, c, d) for c, d in zip(lats, lngs)]
+                for a, b in zip(o_lats, o_lngs)
+            ],
+            repeat
+        )
+        vectorized = self._best(lambda: haversine_matrix(o_lats, o_lngs, lats, lngs), repeat)
+        self.stdout.write(
+            f"{origins}x{size} matrix | loop {loop * 1000:9.2f} ms | "
+            f"haversine_matrix {vectorized * 1000:8.2f} ms | x{loop / vectorized:.1f}"
+        )
@@ -0,0 +1,75 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, close_old_connections, transaction as db_transaction
+
+from core.balances import credit_wallet, compact_shards, wallet_balance
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measures concurrent credit throughput to one hot account with and without balance shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--credits', type=int, default=200, help='عدد الإيداعات لكل خيط')
+        parser.add_argument(
+            '--hold-ms', type=float, default=2.0,
+            help='مدة بقية عمل التحويل داخل المعاملة بعد الإيداع (تحاكي الخصم والإنشاء والقيود)'
+        )
+
+    def _run(self, user_id, sharded, threads, credits, hold):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(credits):
+                    with db_transaction.atomic():
+                        credit_wallet(user_id, Decimal('1.00'), sharded=sharded)
+                        time.sleep(hold)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            self.stderr.write(f"{len(errors)} workers failed: {errors[0]!r}")
+        return elapsed
+
+    def handle(self, *args, **options):
+        threads, credits = options['threads'], options['credits']
+        hold = options['hold_ms'] / 1000
+        if connection.vendor == 'sqlite':
+            self.stderr.write(self.style.WARNING(
+                "SQLite يقفل قاعدة البيانات كاملة عند الكتابة؛ النتائج ذات معنى على PostgreSQL/MySQL فقط."
+            ))
+
+        total_credits = threads * credits
+        for sharded in (False, True):
+            user = User.objects.create(
+                username=f"bench-{uuid.uuid4().hex[:12]}",
+                email=f"bench-{uuid.uuid4().hex[:12]}@bench.local",
+                sharded_balance=sharded
+            )
+            try:
+                elapsed = self._run(user.id, sharded, threads, credits, hold)
+                if sharded:
+                    compact_shards(user.id)
+                balance = wallet_balance(user.id)
+                label = 'sharded' if sharded else 'single row'
+                self.stdout.write(
+                    f"{label:>10}: {total_credits} credits in {elapsed:.2f}s "
+                    f"({total_credits / elapsed:,.0f}/s), final balance {balance}"
+                )
+            finally:
+                user.delete()
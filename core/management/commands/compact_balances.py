@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.balances import compact_shards
+from core.models import BalanceShard
+
+
+class Command(BaseCommand):
+    help = 'Folds sharded sub-balances back into User.total_balance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None, help='التكرار كل N ثانية بدل التشغيل مرة واحدة')
+
+    def compact_all(self):
+        user_ids = (
+            BalanceShard.objects.exclude(balance=0)
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+        compacted = 0
+        total = 0
+        for user_id in list(user_ids):
+            total += compact_shards(user_id)
+            compacted += 1
+        return compacted, total
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            compacted, total = self.compact_all()
+            self.stdout.write(f"Compacted {compacted} accounts, {total} moved to total_balance")
+            if interval is None:
+                break
+            close_old_connections()
+            time.sleep(interval)
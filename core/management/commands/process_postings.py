@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.postings import drain, requeue_stale
+
+
+class Command(BaseCommand):
+    help = 'Drains the queued transaction postings in batches (run several workers to scale out)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--once', action='store_true', help='تنفيذ ما في الطابور ثم الخروج')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='الانتظار عند فراغ الطابور (ثوانٍ)')
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            requeue_stale()
+            count = drain(options['batch_size'])
+            processed += count
+            if count:
+                self.stdout.write(f"Posted {count} queued transactions")
+                continue
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['idle_sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} queued transactions"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user daily transaction rollups from the Transaction table, one user per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help='إعادة بناء ملخصات مستخدم واحد فقط')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='عدد المستخدمين في كل دفعة')
+
+    def handle(self, *args, **options):
+        processed = rebuild(user_id=options['user'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily rollups for {processed} users"))
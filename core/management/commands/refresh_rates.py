@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.rate_matrix import manifest_path, write_matrix
+from core.rates import RateProviderError, base_currency, get_provider, snapshot_path, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Fetches the exchange-rate table from the configured provider into the local snapshot file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base', default=None, help='عملة الأساس (الافتراضي: EXCHANGE_RATE_BASE)')
+        parser.add_argument('--output', default=None, help='مسار اللقطة (الافتراضي: EXCHANGE_RATE_SNAPSHOT)')
+        parser.add_argument('--matrix', default=None, help='مسار مصفوفة الأزواج (الافتراضي: EXCHANGE_RATE_MATRIX)')
+        parser.add_argument('--interval', type=float, default=None, help='التحديث كل N ثانية بدل مرة واحدة')
+
+    def handle(self, *args, **options):
+        base = options['base'] or base_currency()
+        output = options['output'] or snapshot_path()
+        if output is None:
+            raise CommandError("حدد --output أو EXCHANGE_RATE_SNAPSHOT في الإعدادات.")
+        matrix_output = options['matrix'] or manifest_path()
+
+        provider = get_provider()
+        while True:
+            try:
+                rates = provider.fetch(base)
+            except RateProviderError as exc:
+                if options['interval'] is None:
+                    raise CommandError(f"تعذر جلب أسعار الصرف: {exc}")
+                # الإبقاء على اللقطة السابقة حتى المحاولة التالية
+                self.stderr.write(f"Rate refresh failed, keeping previous snapshot: {exc}")
+            else:
+                path = write_snapshot(base, rates, output)
+                self.stdout.write(self.style.SUCCESS(f"Wrote {len(rates)} {base} rates to {path}"))
+                if matrix_output is not None:
+                    path = write_matrix(rates, matrix_output)
+                    self.stdout.write(self.style.SUCCESS(f"Wrote {len(rates)}x{len(rates)} rate matrix to {path}"))
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from core.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Records balance snapshots for every ledger account that changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help='نقطة اللقطة بصيغة ISO (الافتراضي: الآن - LEDGER_SNAPSHOT_LAG)')
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['as_of']:
+            as_of = parse_datetime(options['as_of'])
+            if as_of is None:
+                raise CommandError("صيغة الوقت غير صحيحة، استخدم ISO 8601.")
+
+        created = take_snapshots(as_of)
+        self.stdout.write(self.style.SUCCESS(f"Created {created} balance snapshots"))
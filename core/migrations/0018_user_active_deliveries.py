@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_active_deliveries(apps, schema_editor):
+    # تهيئة العدادات من المعاملات النشطة الحالية
+    User = apps.get_model('core', 'User')
+    Transaction = apps.get_model('core', 'Transaction')
+    counts = (
+        Transaction.objects
+        .filter(delivery_agent__isnull=False, delivery_status__in=['assigned', 'in_transit'])
+        .values('delivery_agent')
+        .annotate(total=Count('id'))
+    )
+    for row in counts:
+        User.objects.filter(pk=row['delivery_agent']).update(active_deliveries=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_deliverylocationhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='active_deliveries',
+            field=models.PositiveIntegerField(default=0, help_text='عدد التسليمات النشطة (assigned / in_transit) المسندة للمندوب'),
+        ),
+        migrations.RunPython(backfill_active_deliveries, migrations.RunPython.noop),
+    ]
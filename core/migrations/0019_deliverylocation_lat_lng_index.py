@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_user_active_deliveries'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliverylocation',
+            index=models.Index(fields=['latitude', 'longitude'], name='core_delive_latitud_72e47f_idx'),
+        ),
+    ]
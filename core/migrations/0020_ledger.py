@@ -0,0 +1,62 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def opening_entries(apps, schema_editor):
+    # قيود افتتاحية بالأرصدة الحالية حتى تطابق أرصدة الدفتر الأعمدة الموجودة
+    User = apps.get_model('core', 'User')
+    CardDetail = apps.get_model('core', 'CardDetail')
+    LedgerEntry = apps.get_model('core', 'LedgerEntry')
+
+    legs = [
+        (f"wallet:{pk}", balance)
+        for pk, balance in User.objects.exclude(total_balance=0).values_list('id', 'total_balance')
+    ] + [
+        (f"card:{pk}", balance)
+        for pk, balance in CardDetail.objects.exclude(balance__isnull=True).exclude(balance=0).values_list('id', 'balance')
+    ]
+    if not legs:
+        return
+    legs.append(('system:opening', -sum(balance for _, balance in legs)))
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(account=account, amount=amount) for account, amount in legs
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_deliverylocation_lat_lng_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=32)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('as_of', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', '-as_of'], name='core_balanc_account_86b211_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=32)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='core.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'created_at'], name='core_ledger_account_cf2c24_idx')],
+            },
+        ),
+        migrations.RunPython(opening_entries, migrations.RunPython.noop),
+    ]
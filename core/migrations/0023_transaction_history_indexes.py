@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_queuedtransaction'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-timestamp'], name='core_transa_user_id_f63fb6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['recipient', '-timestamp'], name='core_transa_recipie_b8fdb4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['delivery_agent', '-timestamp'], name='core_transa_deliver_a457da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-timestamp'], name='core_transa_timesta_a40780_idx'),
+        ),
+    ]
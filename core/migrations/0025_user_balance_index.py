@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-total_balance', '-id'], name='core_user_total_b_ca80f5_idx'),
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from django.conf import settings
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
 import random
 import secrets
 
@@ -48,6 +50,14 @@ class User(AbstractUser):
         help_text="الرصيد الكلي للمستخدم في النظام (محفظة رقمية)"
     )
     passport_number = models.CharField(max_length=15, blank=True,null=True,)
+    active_deliveries = models.PositiveIntegerField(
+        default=0,
+        help_text="عدد التسليمات النشطة (assigned / in_transit) المسندة للمندوب"
+    )
+    sharded_balance = models.BooleanField(
+        default=False,
+        help_text="للحسابات كثيفة الاستلام: الإيداعات تذهب إلى أرصدة فرعية (BalanceShard) تُدمج دوريًا"
+    )
 
     ROLE_CHOICES = [
         ('user', 'User'),
@@ -94,6 +104,12 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
+    class Meta(AbstractUser.Meta):
+        # قائمة الأرصدة للإدارة: ترقيم بالمفتاح (total_balance, id) مباشرة من الفهرس
+        indexes = [
+            models.Index(fields=['-total_balance', '-id']),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -217,6 +233,15 @@ class Transaction(models.Model):
     # حالة التسليم
     delivery_status = models.CharField(max_length=20, choices=DELIVERY_STATUS_CHOICES, default='pending',null=True, blank=True)
 
+    class Meta:
+        # فهارس الترقيم بالمؤشر: كل صفحة قراءة مباشرة من الفهرس مهما كان عمقها
+        indexes = [
+            models.Index(fields=['user', '-timestamp']),
+            models.Index(fields=['recipient', '-timestamp']),
+            models.Index(fields=['delivery_agent', '-timestamp']),
+            models.Index(fields=['-timestamp']),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.amount} {self.currency_from}"
 
@@ -231,6 +256,33 @@ class DeliveryLocation(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # فلترة المندوبين بصندوق إحداثيات (bounding box) قبل حساب المسافة
+            models.Index(fields=['latitude', 'longitude']),
+        ]
+
+
+# --- سجل مواقع المندوب (نقاط GPS بتوقيتها) ---
+class DeliveryLocationHistory(models.Model):
+    delivery_agent = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='location_history',
+        limit_choices_to={'role': 'delivery'}
+    )
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    recorded_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivery_agent', '-recorded_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.delivery_agent_id} @ {self.recorded_at}"
+
 # --- التوقيع الرقمي ---
 class DigitalSignature(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,null=True, blank=True)
@@ -265,4 +317,122 @@ class GuestUser(models.Model):
         return f"{self.first_name} {self.last_name} - Guest"
 
     def get_temporary_token(self):
-        return self.temp_token
\ No newline at end of file
+        return self.temp_token
+
+# --- الأرصدة الفرعية للحسابات الساخنة ---
+# رصيد المحفظة الفعلي = total_balance + مجموع الأرصدة الفرعية.
+class BalanceShard(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_shards')
+    shard = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'shard'], name='unique_balance_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}#{self.shard}: {self.balance}"
+
+
+# --- دفتر القيود (Ledger) ---
+# كل حركة مالية تُسجَّل كقيود مزدوجة: مجموع قيود الحركة الواحدة = صفر.
+# الجدول إضافة فقط (لا تعديل ولا حذف)، والحساب نص مثل "wallet:12" أو "card:5" أو "system:cash".
+class LedgerEntry(models.Model):
+    account = models.CharField(max_length=32)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)  # موجب = إضافة، سالب = خصم
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ledger_entries'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.amount:+} @ {self.created_at}"
+
+
+# --- لقطات الأرصدة ---
+# رصيد كل حساب عند نقطة زمنية (كل القيود حتى as_of)، لتجنب جمع السجل كاملًا.
+class BalanceSnapshot(models.Model):
+    account = models.CharField(max_length=32)
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    as_of = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-as_of']),
+        ]
+
+    def __str__(self):
+        return f"{self.account} = {self.balance} @ {self.as_of}"
+
+
+# --- ملخصات يومية للمعاملات ---
+# مجموع وعدد معاملات كل مستخدم لكل (يوم، عملة، نوع)، تُحدَّث مع كل معاملة في نفس transaction.
+class DailyRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    currency = models.CharField(max_length=3)
+    transaction_type = models.CharField(max_length=20)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'day', 'currency', 'transaction_type'], name='unique_daily_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day} {self.transaction_type}: {self.total} {self.currency}"
+
+
+# --- طابور ترحيل المعاملات (وضع async) ---
+# الطلب يُتحقق منه ويُضاف هنا فورًا (202)، والعمال (process_postings) ينفذونه لاحقًا.
+class QueuedTransaction(models.Model):
+
+    KIND_CHOICES = [
+        ('transfer', 'Transfer'),
+        ('wallet', 'Wallet Transaction'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='queued_transactions')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)  # الاستجابة أو أخطاء التحقق
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
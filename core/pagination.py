@@ -0,0 +1,87 @@
+# core/pagination.py
+
+from base64 import b64decode, b64encode
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class TransactionCursorPagination(CursorPagination):
+    """
+    ترقيم سجل المعاملات بالمؤشر على (timestamp, id) بدل OFFSET:
+    كل صفحة تبدأ من آخر timestamp في الصفحة السابقة، فتكلفة الصفحة العميقة مثل الأولى.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = getattr(settings, 'TRANSACTION_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'TRANSACTION_MAX_PAGE_SIZE', 200)
+
+
+def estimated_count(queryset):
+    """
+    عدد تقريبي لصفوف الجدول من إحصاءات المخطط في PostgreSQL (pg_class.reltuples)
+    بدل COUNT(*) الذي يمسح الجدول كاملًا. بقية قواعد البيانات (أو جدول لم يُحلَّل بعد) تستخدم COUNT(*).
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+    return queryset.count()
+
+
+class BalanceKeysetPagination:
+    """
+    ترقيم قائمة الأرصدة بالمفتاح المركب (total_balance, id) تنازليًا.
+    كل صفحة تبدأ بعد آخر صف في السابقة (بدون OFFSET)، فتكلفتها ثابتة حتى مع آلاف الأرصدة المتساوية.
+    """
+    page_size = getattr(settings, 'BALANCE_PAGE_SIZE', 100)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'BALANCE_MAX_PAGE_SIZE', 500)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, cursor):
+        try:
+            balance, pk = b64decode(cursor.encode(), validate=True).decode().split('|')
+            return Decimal(balance), int(pk)
+        except (ValueError, UnicodeDecodeError, InvalidOperation):
+            raise NotFound("المؤشر غير صالح.")
+
+    def encode_cursor(self, row):
+        return b64encode(f"{row['total_balance']}|{row['id']}".encode()).decode()
+
+    def paginate_queryset(self, queryset, request):
+        """
+        صفوف الصفحة (قواميس من .values()) ورابط الصفحة التالية أو None.
+        """
+        limit = self.get_page_size(request)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            balance, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(total_balance__lt=balance) | Q(total_balance=balance, id__lt=pk)
+            )
+        rows = list(queryset.order_by('-total_balance', '-id')[:limit + 1])
+
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', self.encode_cursor(rows[-1])
+            )
+        return rows, next_url
@@ -0,0 +1,97 @@
+# core/payroll.py
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from .models import User, Transaction
+from . import ledger, rollups
+from .ledger import wallet_account, card_account
+from .balances import withdraw_wallet, withdraw_card, credit_wallets
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def resolve_rows(sender, rows):
+    """
+    التحقق من المستلمين لكل الصفوف باستعلام in_bulk واحد.
+    تُرجع (accepted, report): الصفوف المقبولة مع المستلم، وتقرير لكل صف بالترتيب.
+    """
+    recipients = User.objects.only('id', 'sharded_balance').in_bulk(
+        {row['recipient_id'] for row in rows}
+    )
+
+    accepted = []
+    report = []
+    for index, row in enumerate(rows):
+        result = {"row": index, "recipient_id": row['recipient_id'], "amount": row['amount']}
+        recipient = recipients.get(row['recipient_id'])
+        if recipient is None:
+            result.update(status='rejected', error="المستخدم المستلم غير موجود.")
+        elif recipient.id == sender.id:
+            result.update(status='rejected', error="لا يمكنك إرسال أموال لنفسك.")
+        else:
+            result.update(status='pending')
+            accepted.append((row, recipient, result))
+        report.append(result)
+    return accepted, report
+
+
+def run_bulk_transfer(sender, rows, currency='AED', source='wallet', card_id=None, chunk_size=None):
+    """
+    تنفيذ دفعة تحويلات (رواتب) من محفظة أو بطاقة المرسل داخل معاملة واحدة:
+    إما أن تُنفذ كل الصفوف المقبولة أو لا شيء.
+    تُرجع التقرير النهائي مع حالة كل صف بالترتيب.
+    """
+    chunk_size = chunk_size or getattr(settings, 'PAYROLL_CHUNK_SIZE', 500)
+    accepted, report = resolve_rows(sender, rows)
+    total = sum(row['amount'] for row, _, _ in accepted)
+    source_account = card_account(card_id) if source == 'card' else wallet_account(sender.id)
+
+    with db_transaction.atomic():
+        # ✅ التحقق من الرصيد والخصم مرة واحدة لمجموع الدفعة
+        if accepted:
+            if source == 'card':
+                withdraw_card(card_id, total, user_id=sender.id, currency=currency)
+            else:
+                withdraw_wallet(sender.id, total, currency=currency, sharded=sender.sharded_balance)
+
+        for chunk in _chunks(accepted, chunk_size):
+            amounts = defaultdict(int)
+            for row, recipient, _ in chunk:
+                amounts[recipient.id] += row['amount']
+            credit_wallets(
+                amounts,
+                sharded_ids={recipient.id for _, recipient, _ in chunk if recipient.sharded_balance}
+            )
+
+            transactions = Transaction.objects.bulk_create([
+                Transaction(
+                    user=sender,
+                    recipient=recipient,
+                    transaction_type='send_money',
+                    amount=row['amount'],
+                    currency_from=currency,
+                    currency_to=currency,
+                    status='completed',
+                )
+                for row, recipient, _ in chunk
+            ])
+
+            legs = [(source_account, -sum(amounts.values()))]
+            for (row, recipient, result), transaction in zip(chunk, transactions):
+                legs.append((wallet_account(recipient.id), row['amount'], transaction))
+                result.update(status='completed', transaction_id=transaction.id)
+            ledger.post(legs)
+            rollups.record(transactions)
+
+    return {
+        "completed": len(accepted),
+        "rejected": len(report) - len(accepted),
+        "total_amount": total,
+        "results": report,
+    }
@@ -0,0 +1,143 @@
+# core/postings.py
+
+import logging
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import QueuedTransaction
+from .serializers import TransferSerializer, WalletTransactionSerializer
+
+logger = logging.getLogger(__name__)
+
+SERIALIZERS = {
+    'transfer': TransferSerializer,
+    'wallet': WalletTransactionSerializer,
+}
+
+
+def wants_async(request):
+    """
+    وضع الترحيل غير المتزامن: ?async=1 أو ترويسة Prefer: respond-async.
+    """
+    return (
+        request.query_params.get('async') == '1'
+        or 'respond-async' in request.headers.get('Prefer', '')
+    )
+
+
+def wallet_result(transaction, user):
+    # نفس شكل استجابة WalletTransactionView
+    return {
+        "message": "تمت العملية بنجاح.",
+        "transaction": {
+            "id": transaction.id,
+            "type": transaction.transaction_type,
+            "amount": transaction.amount,
+            "currency": transaction.currency_from,
+            "your_balance": user.total_balance
+        }
+    }
+
+
+def enqueue(user, kind, payload):
+    """
+    إضافة معاملة تم التحقق منها إلى الطابور (INSERT واحد).
+    """
+    if hasattr(payload, 'dict'):
+        payload = payload.dict()  # QueryDict من النماذج
+    return QueuedTransaction.objects.create(user=user, kind=kind, payload=payload)
+
+
+def requeue_stale():
+    """
+    إعادة المهام العالقة في processing (عامل توقف أو خطأ غير متوقع) إلى الطابور،
+    والمهام التي استنفدت POSTING_MAX_ATTEMPTS محاولة تُعلَّم كفاشلة.
+    """
+    timeout = getattr(settings, 'POSTING_CLAIM_TIMEOUT', 300)
+    stale = QueuedTransaction.objects.filter(
+        status='processing',
+        claimed_at__lt=timezone.now() - timedelta(seconds=timeout)
+    )
+    max_attempts = getattr(settings, 'POSTING_MAX_ATTEMPTS', 3)
+    stale.filter(attempts__gte=max_attempts).update(
+        status='failed', result={"error": "تعذر ترحيل المعاملة بعد عدة محاولات."}
+    )
+    return stale.update(status='queued')
+
+
+def claim_batch(size):
+    """
+    حجز دفعة من أقدم المهام. SKIP LOCKED يسمح لعدة عمال بالعمل
+    على نفس الطابور بدون انتظار أو تكرار.
+    """
+    with db_transaction.atomic():
+        batch = list(
+            QueuedTransaction.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('user')
+            .filter(status='queued')
+            .order_by('id')[:size]
+        )
+        if batch:
+            now = timezone.now()
+            QueuedTransaction.objects.filter(id__in=[item.id for item in batch]).update(
+                status='processing', claimed_at=now, attempts=F('attempts') + 1
+            )
+            for item in batch:
+                item.status = 'processing'
+                item.claimed_at = now
+                item.attempts += 1
+    return batch
+
+
+def process(item):
+    """
+    تنفيذ مهمة واحدة بنفس مسار المعاملات المتزامن (التحقق ثم create).
+    الترحيل وتحديث حالة المهمة في نفس db_transaction: إما يُثبَّتان معًا أو لا شيء،
+    فلا تعود مهمة مُرحَّلة إلى الطابور وتُنفَّذ مرة ثانية.
+    """
+    with db_transaction.atomic():
+        # قفل المهمة والتأكد أنها ما زالت محجوزة لنا (لم تُعَد للطابور ويحجزها عامل آخر)
+        claimed = QueuedTransaction.objects.select_for_update().filter(
+            pk=item.pk, status='processing', attempts=item.attempts
+        ).only('id').first()
+        if claimed is None:
+            return item
+
+        user = item.user
+        serializer = SERIALIZERS[item.kind](
+            data=item.payload, context={'request': SimpleNamespace(user=user)}
+        )
+        try:
+            serializer.is_valid(raise_exception=True)
+            transaction = serializer.save()
+        except serializers.ValidationError as exc:
+            item.status = 'failed'
+            item.result = exc.detail
+        else:
+            item.status = 'completed'
+            item.transaction = transaction
+            item.result = (
+                wallet_result(transaction, user) if item.kind == 'wallet' else serializer.data
+            )
+        item.save(update_fields=['status', 'result', 'transaction', 'updated_at'])
+    return item
+
+
+def drain(batch_size=None):
+    """
+    تنفيذ دفعة واحدة من الطابور. تُرجع عدد المهام المنفذة.
+    """
+    batch = claim_batch(batch_size or getattr(settings, 'POSTING_BATCH_SIZE', 100))
+    for item in batch:
+        try:
+            process(item)
+        except Exception:
+            # خطأ غير متوقع: تبقى المهمة في processing وتُعاد للطابور بعد POSTING_CLAIM_TIMEOUT
+            logger.exception("فشل ترحيل المعاملة %s", item.id)
+    return len(batch)
@@ -0,0 +1,73 @@
+# core/quotes.py
+
+import secrets
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import serializers
+
+from .rates import get_exchange_rate
+
+CENT = Decimal('0.01')
+
+
+def _cache_key(token):
+    return f"fx_quote_{token}"
+
+
+def transfer_fee(amount):
+    """
+    عمولة التحويل بعملة المرسل (المستلم يحصل على المبلغ ناقص العمولة).
+    """
+    rate = Decimal(str(getattr(settings, 'TRANSFER_FEE_RATE', '0.10')))
+    return amount - (amount * (1 - rate)).quantize(CENT)
+
+
+def convert(amount, currency_from, currency_to):
+    """
+    تحويل المبلغ بسعر الصرف الحالي. تُرجع (rate, amount_to).
+    """
+    rate = get_exchange_rate(currency_from, currency_to)
+    if not rate:
+        raise serializers.ValidationError({
+            "error": f"تعذر الحصول على سعر صرف بين {currency_from} و {currency_to}"
+        })
+    rate = Decimal(str(rate))
+    return rate, (amount * rate).quantize(CENT)
+
+
+def create_quote(user, amount, currency_from, currency_to):
+    """
+    تثبيت سعر التحويل والعمولة لمدة FX_QUOTE_TTL ثانية تحت رمز واحد.
+    """
+    rate, amount_to = convert(amount, currency_from, currency_to)
+    ttl = getattr(settings, 'FX_QUOTE_TTL', 60)
+    quote = {
+        "quote_token": secrets.token_urlsafe(24),
+        "user_id": user.id,
+        "amount": amount,
+        "currency_from": currency_from,
+        "currency_to": currency_to,
+        "rate": rate,
+        "amount_to": amount_to,
+        "fee": transfer_fee(amount),
+        "expires_at": timezone.now() + timedelta(seconds=ttl),
+    }
+    cache.set(_cache_key(quote["quote_token"]), quote, timeout=ttl)
+    return quote
+
+
+def get_quote(token, user, amount, currency_from, currency_to):
+    """
+    قراءة عرض سعر صالح للمستخدم، ويجب أن يطابق مبلغ وعملات الطلب.
+    العرض يبقى صالحًا لأكثر من تنفيذ حتى انتهاء مدته.
+    """
+    quote = cache.get(_cache_key(token))
+    if quote is None or quote["user_id"] != user.id:
+        raise serializers.ValidationError({"quote_token": "عرض السعر غير موجود أو منتهي الصلاحية."})
+    if (quote["amount"], quote["currency_from"], quote["currency_to"]) != (amount, currency_from, currency_to):
+        raise serializers.ValidationError({"quote_token": "عرض السعر لا يطابق المبلغ أو العملات المطلوبة."})
+    return quote
@@ -0,0 +1,121 @@
+# core/rate_matrix.py
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RateMatrix:
+    """
+    مصفوفة أسعار كثيفة لكل أزواج العملات: matrix[i, j] = سعر التحويل من i إلى j.
+    البحث O(1): فهرس العملة من قاموس ثم قراءة خانة واحدة.
+    """
+
+    def __init__(self, currencies, matrix):
+        self.currencies = list(currencies)
+        self.index = {currency: position for position, currency in enumerate(self.currencies)}
+        self.matrix = matrix
+
+    @classmethod
+    def from_rates(cls, rates):
+        """
+        بناء المصفوفة من جدول أساس واحد: rate(i → j) = rates[j] / rates[i].
+        """
+        currencies = sorted(rates)
+        vector = np.array([float(rates[currency]) for currency in currencies], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix = vector[np.newaxis, :] / vector[:, np.newaxis]
+        return cls(currencies, matrix)
+
+    def rate(self, currency_from, currency_to):
+        i = self.index.get(currency_from)
+        j = self.index.get(currency_to)
+        if i is None or j is None:
+            return None
+        value = float(self.matrix[i, j])
+        return value if np.isfinite(value) and value > 0 else None
+
+
+# --- لقطة المصفوفة على القرص ---
+# ملف .npy يُقرأ بـ mmap فتتشارك كل العمليات نفس الصفحات (قراءة فقط)،
+# وملف manifest صغير يُستبدل ذريًا يشير إلى ملف المصفوفة الحالي وترتيب العملات.
+_loaded = {'mtime': None, 'checked_at': 0.0, 'matrix': None}
+_lock = threading.Lock()
+
+
+def manifest_path():
+    path = getattr(settings, 'EXCHANGE_RATE_MATRIX', None)
+    return Path(path) if path else None
+
+
+def _atomic_write(path, write):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            write(handle)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_matrix(rates, path=None):
+    """
+    كتابة المصفوفة كملف .npy جديد ثم استبدال الـ manifest ذريًا.
+    القرّاء الحاليون يكملون على الملف القديم (mmap) حتى يعيدوا التحميل.
+    """
+    path = Path(path) if path else manifest_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    matrix = RateMatrix.from_rates(rates)
+
+    data_name = f"{path.stem}-{time.time_ns()}.npy"
+    _atomic_write(path.parent / data_name, lambda handle: np.save(handle, matrix.matrix))
+    manifest = json.dumps({'file': data_name, 'currencies': matrix.currencies}).encode()
+    _atomic_write(path, lambda handle: handle.write(manifest))
+
+    # حذف الملفات الأقدم مع إبقاء السابق مباشرة لمن ما زال يقرؤه
+    previous = sorted(path.parent.glob(f"{path.stem}-*.npy"))
+    for old in previous[:-2]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+    return path
+
+
+def load_matrix():
+    path = manifest_path()
+    with _lock:
+        _loaded['checked_at'] = time.monotonic()
+        if path is None:
+            return None
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return _loaded['matrix']
+        if _loaded['mtime'] == mtime:
+            return _loaded['matrix']
+        try:
+            manifest = json.loads(path.read_text(encoding='utf-8'))
+            data = np.load(path.parent / manifest['file'], mmap_mode='r')
+        except (OSError, KeyError, ValueError):
+            logger.warning("تعذر تحميل مصفوفة أسعار الصرف %s", path, exc_info=True)
+            return _loaded['matrix']
+        _loaded.update(mtime=mtime, matrix=RateMatrix(manifest['currencies'], data))
+        return _loaded['matrix']
+
+
+def current_matrix():
+    interval = getattr(settings, 'EXCHANGE_RATE_SNAPSHOT_CHECK', 30)
+    if time.monotonic() - _loaded['checked_at'] >= interval:
+        load_matrix()
+    return _loaded['matrix']
@@ -0,0 +1,291 @@
+# core/rates.py
+
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .rate_matrix import RateMatrix, current_matrix
+
+logger = logging.getLogger(__name__)
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class RateProviderError(Exception):
+    pass
+
+
+class RateProvider:
+    """
+    مصدر جداول أسعار الصرف: fetch(base) تُرجع {currency: rate} نسبةً إلى base.
+    """
+
+    def fetch(self, base):
+        raise NotImplementedError
+
+
+def rebase(rates, source_base, base):
+    if source_base == base:
+        return dict(rates)
+    try:
+        pivot = float(rates[base])
+    except (KeyError, TypeError, ValueError):
+        raise RateProviderError(f"العملة {base} غير موجودة في الجدول")
+    return {currency: float(rate) / pivot for currency, rate in rates.items()}
+
+
+class HTTPRateProvider(RateProvider):
+    def __init__(self, url='https://api.exchangerate-api.com/v4/latest/{base}', timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self, base):
+        try:
+            response = requests.get(self.url.format(base=base), timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['rates']
+        except (requests.RequestException, KeyError, ValueError) as exc:
+            raise RateProviderError(str(exc)) from exc
+
+
+class FileRateProvider(RateProvider):
+    """
+    جدول أسعار من ملف محلي:
+    - JSON: {"base": "USD", "rates": {"AED": 3.6725, ...}}
+    - CSV: أعمدة currency,rate نسبةً إلى base (الافتراضي USD).
+    """
+
+    def __init__(self, path, base='USD'):
+        self.path = Path(path)
+        self.base = base
+
+    def load(self):
+        try:
+            if self.path.suffix.lower() == '.csv':
+                with open(self.path, newline='', encoding='utf-8') as handle:
+                    rates = {row['currency'].strip(): float(row['rate']) for row in csv.DictReader(handle)}
+                return self.base, rates
+            with open(self.path, encoding='utf-8') as handle:
+                data = json.load(handle)
+            return data.get('base', self.base), data['rates']
+        except (OSError, KeyError, ValueError) as exc:
+            raise RateProviderError(str(exc)) from exc
+
+    def fetch(self, base):
+        source_base, rates = self.load()
+        return rebase(rates, source_base, base)
+
+
+class FixedRateProvider(RateProvider):
+    """
+    جدول ثابت في الذاكرة (للاختبارات والتشغيل بدون شبكة).
+    """
+
+    def __init__(self, rates, base='USD'):
+        self.rates = rates
+        self.base = base
+
+    def fetch(self, base):
+        return rebase(self.rates, self.base, base)
+
+
+def get_provider():
+    provider_class = import_string(getattr(settings, 'EXCHANGE_RATE_PROVIDER', 'core.rates.HTTPRateProvider'))
+    return provider_class(**getattr(settings, 'EXCHANGE_RATE_PROVIDER_OPTIONS', {}))
+
+
+# --- اللقطة المحلية ---
+# refresh_rates يكتب الجدول إلى ملف محلي، والعمال يحمّلونه في الذاكرة عند الإقلاع
+# ويعيدون تحميله عند تغيّر الملف، فلا يوجد أي اتصال شبكي في مسار الطلب.
+_snapshot = {'path': None, 'mtime': None, 'checked_at': 0.0, 'base': None, 'rates': None, 'matrix': None}
+_snapshot_lock = threading.Lock()
+
+
+def snapshot_path():
+    path = getattr(settings, 'EXCHANGE_RATE_SNAPSHOT', None)
+    return Path(path) if path else None
+
+
+def write_snapshot(base, rates, path=None):
+    """
+    كتابة اللقطة بشكل ذري: ملف مؤقت في نفس المجلد ثم os.replace.
+    """
+    path = Path(path) if path else snapshot_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump({'base': base, 'rates': rates, 'fetched_at': time.time()}, handle)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+
+def load_snapshot():
+    """
+    تحميل اللقطة في ذاكرة العملية (عند الإقلاع أو عند تغيّر الملف).
+    """
+    path = snapshot_path()
+    with _snapshot_lock:
+        _snapshot['checked_at'] = time.monotonic()
+        if path is None:
+            return None
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return None
+        if _snapshot['path'] == path and _snapshot['mtime'] == mtime:
+            return _snapshot
+        try:
+            base, rates = FileRateProvider(path).load()
+        except RateProviderError:
+            logger.warning("تعذر تحميل لقطة أسعار الصرف %s", path, exc_info=True)
+            return None
+        _snapshot.update(path=path, mtime=mtime, base=base, rates=rates, matrix=RateMatrix.from_rates(rates))
+        return _snapshot
+
+
+def current_snapshot():
+    interval = getattr(settings, 'EXCHANGE_RATE_SNAPSHOT_CHECK', 30)
+    if time.monotonic() - _snapshot['checked_at'] >= interval:
+        load_snapshot()
+    return _snapshot if _snapshot['rates'] is not None else None
+
+
+def _cache_key(base):
+    return f"exchange_rates_{base}"
+
+
+def _lock_for(base):
+    with _locks_guard:
+        return _locks.setdefault(base, threading.Lock())
+
+
+def base_currency():
+    return getattr(settings, 'EXCHANGE_RATE_BASE', 'USD')
+
+
+def fetch_rates(base):
+    """
+    تحميل جدول الأسعار كاملًا لعملة أساس واحدة من المزوّد المضبوط في الإعدادات.
+    """
+    return get_provider().fetch(base)
+
+
+def _store(base, rates):
+    entry = {'rates': rates, 'fetched_at': time.time()}
+    # الجدول يبقى في الكاش بعد انتهاء صلاحيته ليُخدم قديمًا أثناء التحديث
+    cache.set(_cache_key(base), entry, timeout=getattr(settings, 'EXCHANGE_RATE_MAX_STALE', 86400))
+    return entry
+
+
+def _refresh(base):
+    try:
+        return _store(base, fetch_rates(base))
+    except RateProviderError:
+        logger.warning("تعذر تحديث أسعار الصرف لـ %s", base, exc_info=True)
+        return None
+
+
+def _claim_refresh(base):
+    # حجز التحديث على مستوى كل العمليات: جلب واحد فقط في نفس الوقت
+    return cache.add(f"exchange_rates_refreshing_{base}", True, timeout=30)
+
+
+def _release_refresh(base):
+    cache.delete(f"exchange_rates_refreshing_{base}")
+
+
+def _refresh_in_background(base):
+    if not _claim_refresh(base):
+        return
+
+    def run():
+        try:
+            _refresh(base)
+        finally:
+            _release_refresh(base)
+
+    threading.Thread(target=run, name=f'rates-refresh-{base}', daemon=True).start()
+
+
+def _fetch_coalesced(base):
+    if _claim_refresh(base):
+        try:
+            return _refresh(base)
+        finally:
+            _release_refresh(base)
+
+    # عملية أخرى تجلب الجدول الآن: ننتظر نتيجتها بدل طلب ثانٍ
+    deadline = time.monotonic() + getattr(settings, 'EXCHANGE_RATE_WAIT_SECONDS', 5)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(_cache_key(base))
+        if entry is not None:
+            return entry
+    return _refresh(base)
+
+
+def get_rates(base=None):
+    """
+    جدول أسعار عملة الأساس: من اللقطة المحلية إن وُجدت، وإلا من الكاش.
+    - حديث (أقل من EXCHANGE_RATE_TTL): يُرجع مباشرة.
+    - قديم: يُرجع فورًا ويُحدَّث مرة واحدة في الخلفية (stale-while-revalidate).
+    - غير موجود: طلب واحد فقط يجلب الجدول والبقية ينتظرونه (منع التدافع).
+    """
+    base = base or base_currency()
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        try:
+            return rebase(snapshot['rates'], snapshot['base'], base)
+        except RateProviderError:
+            pass
+
+    entry = cache.get(_cache_key(base))
+    if entry is not None:
+        if time.time() - entry['fetched_at'] >= getattr(settings, 'EXCHANGE_RATE_TTL', 3600):
+            _refresh_in_background(base)
+        return entry['rates']
+
+    with _lock_for(base):
+        # ربما جلبه خيط آخر أثناء الانتظار
+        entry = cache.get(_cache_key(base))
+        if entry is None:
+            entry = _fetch_coalesced(base)
+    return entry['rates'] if entry else None
+
+
+def get_exchange_rate(from_currency, to_currency):
+    """
+    سعر الصرف بين أي عملتين: قراءة خانة واحدة من المصفوفة المحسوبة مسبقًا.
+    """
+    if from_currency == to_currency:
+        return 1.0
+    matrix = current_matrix()
+    if matrix is None:
+        snapshot = current_snapshot()
+        matrix = snapshot['matrix'] if snapshot is not None else None
+    if matrix is not None:
+        return matrix.rate(from_currency, to_currency)
+
+    # بدون لقطة: النسبة من جدول الكاش (لا تعتمد على عملة الأساس)
+    rates = get_rates()
+    if not rates:
+        return None
+    try:
+        return float(rates[to_currency]) / float(rates[from_currency])
+    except (KeyError, ZeroDivisionError):
+        return None
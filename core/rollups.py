@@ -0,0 +1,146 @@
+# core/rollups.py
+
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .activity import CREDIT_TYPES, DEBIT_TYPES
+from .models import DailyRollup, Transaction, User
+
+PERIODS = {
+    'day': F('day'),
+    'week': TruncWeek('day'),
+    'month': TruncMonth('day'),
+}
+
+
+def aggregate(transactions):
+    """
+    تجميع المعاملات حسب (user, day, currency, transaction_type) → [total, count].
+    معاملات الضيوف (بدون user) لا تدخل في الملخصات.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for transaction in transactions:
+        if transaction.user_id is None or transaction.amount is None:
+            continue
+        key = (
+            transaction.user_id,
+            timezone.localdate(transaction.timestamp or timezone.now()),
+            transaction.currency_from or '',
+            transaction.transaction_type or '',
+        )
+        deltas[key][0] += transaction.amount
+        deltas[key][1] += 1
+    return deltas
+
+
+def _increment(key, total, count):
+    user_id, day, currency, transaction_type = key
+    return DailyRollup.objects.filter(
+        user_id=user_id, day=day, currency=currency, transaction_type=transaction_type
+    ).update(total=F('total') + total, count=F('count') + count)
+
+
+def apply(deltas):
+    """
+    إضافة الفروقات للملخصات: UPDATE بـ F() للصفوف الموجودة، والناقصة تُنشأ دفعة واحدة.
+    إذا أنشأت معاملة متزامنة نفس الصف أولًا نعيد المحاولة كتحديث.
+    """
+    missing = {key: value for key, value in deltas.items() if not _increment(key, *value)}
+    if not missing:
+        return
+
+    rows = [
+        DailyRollup(user_id=user_id, day=day, currency=currency, transaction_type=transaction_type,
+                    total=total, count=count)
+        for (user_id, day, currency, transaction_type), (total, count) in missing.items()
+    ]
+    try:
+        with db_transaction.atomic():
+            DailyRollup.objects.bulk_create(rows)
+    except IntegrityError:
+        for key, (total, count) in missing.items():
+            if not _increment(key, total, count):
+                user_id, day, currency, transaction_type = key
+                DailyRollup.objects.create(
+                    user_id=user_id, day=day, currency=currency, transaction_type=transaction_type,
+                    total=total, count=count
+                )
+
+
+def record(transactions):
+    """
+    تحديث الملخصات بمعاملات جديدة. تُستدعى داخل نفس db_transaction التي أنشأت المعاملات.
+    """
+    apply(aggregate(transactions))
+
+
+def rebuild_user(user_id):
+    """
+    إعادة بناء ملخصات مستخدم واحد داخل معاملة واحدة.
+    الحذف أولًا: يقفل صفوف المستخدم وينتظر أي معاملة جارية تحدّثها، ثم التجميع بعده
+    يرى ما ثبّتته تلك المعاملات. والمعاملات التي تنتهي بعد التجميع تضيف نفسها عبر
+    apply() (زيادة الصف الجديد أو إنشاؤه)، فلا يُحسب شيء مرتين ولا يضيع.
+    """
+    with db_transaction.atomic():
+        DailyRollup.objects.filter(user_id=user_id).delete()
+        rows = (
+            Transaction.objects.filter(user_id=user_id, amount__isnull=False, timestamp__isnull=False)
+            .values('currency_from', 'transaction_type', date=TruncDate('timestamp'))
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by()
+        )
+        apply({
+            (user_id, row['date'], row['currency_from'] or '', row['transaction_type'] or ''):
+                [row['total'], row['count']]
+            for row in rows
+        })
+
+
+def rebuild(user_id=None, chunk_size=1000):
+    """
+    إعادة بناء الملخصات من جدول Transaction، مستخدمًا تلو الآخر
+    (المستخدمون يُقرؤون على دفعات حسب id). تُرجع عدد المستخدمين.
+    """
+    if user_id is not None:
+        rebuild_user(user_id)
+        return 1
+
+    processed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        for pk in ids:
+            rebuild_user(pk)
+        processed += len(ids)
+        last_id = ids[-1]
+    return processed
+
+
+def summarize(user, period='day', start=None, end=None):
+    """
+    مجموع الإيداعات (credit) والخصومات (debit) لكل فترة وعملة من الملخصات فقط.
+    التحويل بين البطاقة والمحفظة لا يُحسب في أي منهما (يدخل في count فقط).
+    """
+    rollups = DailyRollup.objects.filter(user=user)
+    if start:
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+    return (
+        rollups.annotate(period=PERIODS[period])
+        .values('period', 'currency')
+        .annotate(
+            credit=Sum('total', filter=Q(transaction_type__in=CREDIT_TYPES), default=0),
+            debit=Sum('total', filter=Q(transaction_type__in=DEBIT_TYPES), default=0),
+            count=Sum('count'),
+        )
+        .order_by('-period', 'currency')
+    )
@@ -0,0 +1,93 @@
+# core/routing.py
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .geo import haversine_distance, haversine_matrix
+
+
+def nearest_neighbour_order(matrix):
+    """
+    ترتيب أولي: من نقطة البداية (0) إلى أقرب نقطة لم تُزر بعد، وهكذا.
+    """
+    size = len(matrix)
+    order = [0]
+    remaining = set(range(1, size))
+    while remaining:
+        last = order[-1]
+        nearest = min(remaining, key=lambda stop: matrix[last][stop])
+        order.append(nearest)
+        remaining.remove(nearest)
+    return order
+
+
+def two_opt(order, matrix):
+    """
+    تحسين 2-opt لمسار مفتوح يبدأ من نقطة ثابتة (order[0]):
+    عكس أي مقطع يقلل المسافة الكلية حتى لا يوجد تحسين.
+    """
+    order = list(order)
+    last = len(order) - 1
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, last):
+            for j in range(i + 1, last + 1):
+                a, b = order[i - 1], order[i]
+                c = order[j]
+                before = matrix[a][b]
+                after = matrix[a][c]
+                if j < last:
+                    d = order[j + 1]
+                    before += matrix[c][d]
+                    after += matrix[b][d]
+                if after < before - 1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+    return order
+
+
+def _plan_cache_key(agent_id, transaction_ids):
+    digest = hashlib.md5(
+        ",".join(str(pk) for pk in sorted(transaction_ids)).encode()
+    ).hexdigest()
+    return f"route_order_{agent_id}_{digest}"
+
+
+def plan_route(agent_id, start, transactions):
+    """
+    ترتيب تسليمات المندوب المفتوحة في مسار زيارة فعال انطلاقًا من موقعه.
+    start: (lat, lng). transactions: معاملات تحتوي إحداثيات المستلم.
+    تُرجع قائمة [(transaction, leg_km, cumulative_km)] بترتيب الزيارة.
+    يُخزَّن ترتيب الزيارة فقط في الكاش حتى تتغير مجموعة التسليمات،
+    أما المسافات فتُحسب في كل طلب من موقع المندوب الحالي.
+    """
+    by_id = {t.id: t for t in transactions}
+    if not by_id:
+        return []
+
+    key = _plan_cache_key(agent_id, by_id.keys())
+    order = cache.get(key)
+    if order is None:
+        ids = list(by_id)
+        lats = [start[0]] + [by_id[pk].recipient_latitude for pk in ids]
+        lngs = [start[1]] + [by_id[pk].recipient_longitude for pk in ids]
+        matrix = haversine_matrix(lats, lngs, lats, lngs).tolist()
+
+        order = [ids[stop - 1] for stop in two_opt(nearest_neighbour_order(matrix), matrix)[1:]]
+        cache.set(key, order, timeout=getattr(settings, 'ROUTE_PLAN_TTL', 3600))
+
+    route = []
+    cumulative = 0.0
+    position = start
+    for pk in order:
+        transaction = by_id[pk]
+        destination = (transaction.recipient_latitude, transaction.recipient_longitude)
+        leg = haversine_distance(float(position[0]), float(position[1]),
+                                 float(destination[0]), float(destination[1]))
+        cumulative += leg
+        route.append((transaction, leg, cumulative))
+        position = destination
+    return route
@@ -7,13 +7,23 @@ from .models import User, CardDetail, Transaction, DigitalSignature,DeliveryLoca
 from decimal import Decimal
 from datetime import datetime
 import re
-import math
-from .utils import get_exchange_rate
+from .quotes import convert, get_quote, transfer_fee
+from .dispatch import best_agent, increment_workload
+from . import ledger, rollups
+from .ledger import CASH, FEES, OPENING, wallet_account, card_account
+from .balances import (
+    InsufficientFunds, withdraw_wallet, withdraw_card, credit_wallet, credit_card, deposit_card,
+    wallet_balance
+)
+from rest_framework.settings import api_settings
+
+NON_FIELD_ERRORS = api_settings.NON_FIELD_ERRORS_KEY
 from django.contrib.auth import get_user_model
 from .models import generate_otp
 from django.core.cache import cache
 from django.core.cache import cache
 from django.utils import timezone
+from django.conf import settings
 import json
 User = get_user_model()
 
@@ -215,25 +225,6 @@ class VerifyOTPSerializer(serializers.Serializer):
         cache.delete(f"register_data_{email}")
 
         return user
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """
-    حساب المسافة بين نقطتين (lat, lon) بالكيلومتر.
-    """
-    R = 6371  # نصف قطر الأرض
-
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-
-    a = math.sin(dphi / 2) ** 2 + \
-        math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    return R * c
-
-
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -300,13 +291,25 @@ class CardDetailSerializer(serializers.ModelSerializer):
         # استخراج آخر 4 أرقام
         last_four = card_number[-4:]
 
-        # إنشاء البطاقة
-        card = CardDetail.objects.create(
-            # user=self.context['request'].user,
-            last_four=last_four,
-            # expiry=expiry,
-            **validated_data
-        )
+        # إنشاء البطاقة مع قيد افتتاحي برصيدها حتى يطابق حساب card:<id> في دفتر القيود
+        with db_transaction.atomic():
+            card = CardDetail.objects.create(
+                # user=self.context['request'].user,
+                last_four=last_four,
+                # expiry=expiry,
+                **validated_data
+            )
+            if card.balance:
+                ledger.transfer(OPENING, card_account(card.id), card.balance)
+        return card
+
+    def update(self, instance, validated_data):
+        # تعديل الرصيد يدويًا يُسجَّل كقيد تسوية بالفرق
+        previous = instance.balance or 0
+        with db_transaction.atomic():
+            card = super().update(instance, validated_data)
+            if 'balance' in validated_data:
+                ledger.transfer(OPENING, card_account(card.id), (card.balance or 0) - previous)
         return card
 
 class TransactionSerializer(serializers.ModelSerializer):
@@ -364,16 +367,11 @@ class TransactionSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"amount": "يجب أن يكون المبلغ أكبر من صفر."})
 
         # ✅ التحقق من أن البطاقة تخص المستخدم
-        if card_id.user != user:
+        if card_id.user_id != user.id:
             raise serializers.ValidationError({
                 "error": "لا يمكنك استخدام بطاقة لا تخصك."
             })
-
-        # ✅ التحقق من أن رصيد البطاقة كافٍ
-        if card_id.balance < amount:
-            raise serializers.ValidationError({
-                "error": f"رصيد البطاقة غير كافٍ. الرصيد الحالي: {card_id.balance} {validated_data['currency_from']}"
-            })
+        # كفاية الرصيد تُتحقق داخل الخصم نفسه (UPDATE مشروط) لتجنب السباق
 
         # استخراج حقول الموقع
         sender_lat = validated_data.pop('sender_latitude', None)
@@ -383,6 +381,7 @@ class TransactionSerializer(serializers.ModelSerializer):
 
         recipient_id = validated_data.pop('recipient_id', None)
         recipient = None
+        recipient_card = None
         sender = None
 
         # التحقق من الموقع حسب نوع المعاملة
@@ -400,7 +399,8 @@ class TransactionSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("حقلَي الموقع (المرسل والمستقبل) مطلوبان.")
 
             # ✅ التحقق من أن المستقبل لديه بطاقة
-            if not recipient.cards.exists():
+            recipient_card = recipient.cards.only('id').first()
+            if not recipient_card:
                 raise serializers.ValidationError({
                     "error": "المستلم لا يملك بطاقة. لا يمكن إرسال الأموال."
                 })
@@ -417,7 +417,8 @@ class TransactionSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("حقلَي الموقع (المرسل والمستقبل) مطلوبان.")
 
             # ✅ التحقق من أن المستقبل (أنا) لديه بطاقة
-            if not recipient.cards.exists():
+            recipient_card = recipient.cards.only('id').first()
+            if not recipient_card:
                 raise serializers.ValidationError({
                     "error": "ليس لديك بطاقة لتلقي الأموال."
                 })
@@ -430,7 +431,7 @@ class TransactionSerializer(serializers.ModelSerializer):
                 })
             if sender_card.balance < amount:
                 raise serializers.ValidationError({
-                    "error": f"رصيد بطاقة المرسل غير كافٍ. الرصيد الحالي: {sender_card.balance} {currency_from}"
+                    "error": f"رصيد بطاقة المرسل غير كافٍ. الرصيد الحالي: {sender_card.balance} {validated_data['currency_from']}"
                 })
         elif transaction_type == 'withdrawal':
             sender = None
@@ -446,42 +447,30 @@ class TransactionSerializer(serializers.ModelSerializer):
         else:
             raise serializers.ValidationError("نوع المعاملة غير صالح.")
         
+        # ✅ أنسب مندوب (المسافة + الحمل) عبر الفهرس الجغرافي
         closest_delivery_agent = None
-        min_distance = None
         if recipient_lat and recipient_lng:
-            delivery_locations = DeliveryLocation.objects.select_related('delivery_agent').all()
-
-            for location in delivery_locations:
-                if not location.delivery_agent.is_approved:
-                    continue
-
-                distance = haversine_distance(
-                    float(recipient_lat),
-                    float(recipient_lng),
-                    float(location.latitude),
-                    float(location.longitude)
-                )
-
-                if min_distance is None or distance < min_distance:
-                    min_distance = distance
-                    closest_delivery_agent = location.delivery_agent
+            closest_delivery_agent = best_agent(recipient_lat, recipient_lng)
         # ✅ استخدام المعاملات (atomic) لضمان الأمان
         with db_transaction.atomic():
-            # ✅ خصم المبلغ من بطاقة المرسل
-            card_id.balance -= amount
-            card_id.save(update_fields=['balance'])
+            # ✅ خصم المبلغ من بطاقة المرسل (استعلام واحد مشروط بكفاية الرصيد)
+            withdraw_card(card_id.id, amount, currency=validated_data['currency_from'])
+            legs = [(card_account(card_id.id), -amount)]
 
             # ✅ إضافة المبلغ إلى بطاقة المستقبل (في حالات send_money و receive_money)
             if transaction_type in ['send_money', 'receive_money']:
-        
-                # مثال: إذا كانت العمولة 10%، فإن المستقبل يستلم 90%
-                currency_from = validated_data['currency_from']
-                currency_to = validated_data['currency_to']
-                
-                amount_received = (amount * Decimal('0.90')).quantize(Decimal('0.01'))
-                recipient_card = recipient.cards.first()
-                recipient_card.balance += amount_received
-                recipient_card.save(update_fields=['balance'])
+                # العمولة (TRANSFER_FEE_RATE، افتراضيًا 10%) إلا إذا ثُبتت مسبقًا في عرض سعر
+                fee = validated_data.pop('fee', None)
+                if fee is None:
+                    fee = transfer_fee(amount)
+                amount_received = amount - fee
+                credit_card(recipient_card.id, amount_received)
+                legs += [
+                    (card_account(recipient_card.id), amount_received),
+                    (FEES, amount - amount_received),
+                ]
+            else:
+                legs.append((CASH, amount))
 
             # إنشاء المعاملة
             transaction = Transaction.objects.create(
@@ -502,6 +491,10 @@ class TransactionSerializer(serializers.ModelSerializer):
                 address=address,    
                 delivery_status='assigned'
             )
+            ledger.post(legs, transaction=transaction)
+            rollups.record([transaction])
+            if closest_delivery_agent:
+                increment_workload(closest_delivery_agent.id)
 
         return transaction
 
@@ -512,29 +505,43 @@ class TransferSerializer(TransactionSerializer):
     """
     سيريالايزر مخصص للتحويلات بين العملات.
     يرث من TransactionSerializer لكنه يضيف منطق التحويل.
+    مع quote_token يُستخدم السعر والعمولة المثبتان في عرض السعر بدل جلبهما من جديد.
     """
+    quote_token = serializers.CharField(write_only=True, required=False)
+
+    class Meta(TransactionSerializer.Meta):
+        fields = TransactionSerializer.Meta.fields + ['quote_token']
+
     def create(self, validated_data):
         # استخدم نفس منطق الأب، لكن مع تمكين تحويل العملات
         transaction_type = validated_data['transaction_type']
         currency_from = validated_data['currency_from']
         currency_to = validated_data['currency_to']
+        quote_token = validated_data.pop('quote_token', None)
 
         # فقط في التحويلات المالية، نُفعّل تحويل العملات
         if transaction_type in ['send_money', 'receive_money']:
-            rate = get_exchange_rate(currency_from, currency_to)
-            if not rate:
-                raise serializers.ValidationError({
-                    "error": f"تعذر الحصول على سعر صرف بين {currency_from} و {currency_to}"
-                })
-            rate_decimal = Decimal(str(rate))
             amount = validated_data['amount']
-            converted_amount = amount * rate_decimal
-            validated_data['amount_to'] = converted_amount.quantize(Decimal('0.01'))
-            amount_to =   validated_data['amount_to']
+            if quote_token:
+                quote = get_quote(
+                    quote_token, self.context['request'].user, amount, currency_from, currency_to
+                )
+                validated_data['amount_to'] = quote['amount_to']
+                validated_data['fee'] = quote['fee']
+            else:
+                _, validated_data['amount_to'] = convert(amount, currency_from, currency_to)
 
 
         # استخدم منطق الأب (لكن بدون خصم/إضافة رصيد مكرر)
         return super().create(validated_data)
+
+
+class FXQuoteSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+    currency_from = serializers.CharField(max_length=3)
+    currency_to = serializers.CharField(max_length=3)
+
+
 class DeliveryLocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeliveryLocation
@@ -552,6 +559,52 @@ class DeliveryLocationSerializer(serializers.ModelSerializer):
         return value
 
 
+class DeliveryLocationPointSerializer(DeliveryLocationSerializer):
+    recorded_at = serializers.DateTimeField()
+
+    class Meta(DeliveryLocationSerializer.Meta):
+        fields = ['latitude', 'longitude', 'recorded_at']
+
+
+class BulkDeliveryLocationSerializer(serializers.Serializer):
+    """
+    دفعة نقاط GPS مخزنة على جهاز المندوب (عند ضعف الاتصال).
+    """
+    points = DeliveryLocationPointSerializer(many=True, allow_empty=False)
+
+    def validate_points(self, value):
+        max_points = getattr(settings, 'LOCATION_BULK_MAX_POINTS', 1000)
+        if len(value) > max_points:
+            raise serializers.ValidationError(f"الحد الأقصى للنقاط في الدفعة الواحدة هو {max_points}.")
+        return value
+
+
+class BulkTransferRowSerializer(serializers.Serializer):
+    recipient_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+
+
+class BulkTransferSerializer(serializers.Serializer):
+    """
+    دفعة تحويلات (رواتب) من محفظة أو بطاقة المستخدم إلى محافظ عدة مستلمين.
+    """
+    rows = BulkTransferRowSerializer(many=True, allow_empty=False)
+    currency = serializers.CharField(max_length=3, default='AED')
+    source = serializers.ChoiceField(choices=[('wallet', 'Wallet'), ('card', 'Card')], default='wallet')
+    card_id = serializers.IntegerField(required=False)
+
+    def validate_rows(self, value):
+        max_rows = getattr(settings, 'PAYROLL_MAX_ROWS', 10000)
+        if len(value) > max_rows:
+            raise serializers.ValidationError(f"الحد الأقصى للصفوف في الدفعة الواحدة هو {max_rows}.")
+        return value
+
+    def validate(self, data):
+        if data['source'] == 'card' and not data.get('card_id'):
+            raise serializers.ValidationError("حقل 'card_id' مطلوب عند الدفع من البطاقة.")
+        return data
+
+
 class DigitalSignatureSerializer(serializers.ModelSerializer):
     class Meta:
         model = DigitalSignature
@@ -663,42 +716,52 @@ class GuestTransactionSerializer(serializers.Serializer):
         closest_delivery_agent = None
 
         if recipient_lat and recipient_lng:
-            # from .utils import haversine_distance
-            delivery_locations = DeliveryLocation.objects.select_related('delivery_agent').all()
-            min_distance = None
-            for location in delivery_locations:
-                if not location.delivery_agent.is_approved:
-                    continue
-                distance = haversine_distance(
-                    float(recipient_lat),
-                    float(recipient_lng),
-                    float(location.latitude),
-                    float(location.longitude)
-                )
-                if min_distance is None or distance < min_distance:
-                    min_distance = distance
-                    closest_delivery_agent = location.delivery_agent
+            closest_delivery_agent = best_agent(recipient_lat, recipient_lng)
 
         # ✅ إنشاء المعاملة مع recipient و delivery_agent
-        transaction = Transaction.objects.create(
-            user=None,
-            card=temp_card,
-            transaction_type=validated_data['transaction_type'],
-            amount=validated_data['amount'],
-            currency_from=validated_data['currency_from'],
-            sender_latitude=validated_data['sender_latitude'],
-            sender_longitude=validated_data['sender_longitude'],
-            recipient_latitude=recipient_lat,
-            recipient_longitude=recipient_lng,
-            recipient=recipient,  # ✅ تم الإضافة
-            delivery_agent=closest_delivery_agent,  # ✅ تم التعيين التلقائي
-            delivery_status='assigned'  # أو 'pending'
-        )
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(
+                user=None,
+                card=temp_card,
+                transaction_type=validated_data['transaction_type'],
+                amount=validated_data['amount'],
+                currency_from=validated_data['currency_from'],
+                sender_latitude=validated_data['sender_latitude'],
+                sender_longitude=validated_data['sender_longitude'],
+                recipient_latitude=recipient_lat,
+                recipient_longitude=recipient_lng,
+                recipient=recipient,  # ✅ تم الإضافة
+                delivery_agent=closest_delivery_agent,  # ✅ تم التعيين التلقائي
+                delivery_status='assigned'  # أو 'pending'
+            )
+            if closest_delivery_agent:
+                increment_workload(closest_delivery_agent.id)
 
         return transaction
 
 # serializers.py
 
+class ActivitySerializer(serializers.ModelSerializer):
+    # يُحسبان في استعلام السجل (core.activity)
+    direction = serializers.CharField(read_only=True)
+    counterparty_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Transaction
+        fields = [
+            'id',
+            'transaction_type',
+            'direction',
+            'counterparty_id',
+            'amount',
+            'currency_from',
+            'amount_to',
+            'currency_to',
+            'status',
+            'timestamp',
+        ]
+
+
 class DeliveryTransactionSerializer(serializers.ModelSerializer):
     sender_name = serializers.SerializerMethodField()
     recipient_name = serializers.SerializerMethodField()
@@ -914,56 +977,20 @@ class WalletTransactionSerializer(serializers.Serializer):
         if transaction_type == 'withdrawal':
             if not data.get('withdrawal_source'):
                 raise serializers.ValidationError("حقل 'withdrawal_source' مطلوب عند السحب.")
-            if data['withdrawal_source'] == 'card':
-                if not data.get('card_id'):
-                    raise serializers.ValidationError("حقل 'card_id' مطلوب عند السحب من البطاقة.")
-                try:
-                    card = CardDetail.objects.get(id=data['card_id'], user=user)
-                    if card.balance < data['amount']:
-                        raise serializers.ValidationError("رصيد البطاقة غير كافٍ.")
-                except CardDetail.DoesNotExist:
-                    raise serializers.ValidationError("البطاقة غير موجودة أو لا تخصك.")
-            elif data['withdrawal_source'] == 'wallet':
-                if user.total_balance < data['amount']:
-                    raise serializers.ValidationError(f"رصيد المحفظة غير كافٍ. الرصيد الحالي: {user.total_balance} {data['currency']}")
+            if data['withdrawal_source'] == 'card' and not data.get('card_id'):
+                raise serializers.ValidationError("حقل 'card_id' مطلوب عند السحب من البطاقة.")
 
         # التحقق من مصدر الإرسال (send_money)
         if transaction_type == 'send_money':
             if not data.get('send_source'):
                 raise serializers.ValidationError("حقل 'send_source' مطلوب عند إرسال الأموال.")
-            if data['send_source'] == 'card':
-                if not data.get('card_id'):
-                    raise serializers.ValidationError("حقل 'card_id' مطلوب عند الإرسال من البطاقة.")
-                try:
-                    card = CardDetail.objects.get(id=data['card_id'], user=user)
-                    if card.balance < data['amount']:
-                        raise serializers.ValidationError("رصيد البطاقة غير كافٍ.")
-                except CardDetail.DoesNotExist:
-                    raise serializers.ValidationError("البطاقة غير موجودة أو لا تخصك.")
-            elif data['send_source'] == 'wallet':
-                if user.total_balance < data['amount']:
-                    raise serializers.ValidationError(f"رصيد المحفظة غير كافٍ. الرصيد الحالي: {user.total_balance} {data['currency']}")
+            if data['send_source'] == 'card' and not data.get('card_id'):
+                raise serializers.ValidationError("حقل 'card_id' مطلوب عند الإرسال من البطاقة.")
 
         # التحقق من card_id للتحويلات بين البطاقة والمحفظة
-        if transaction_type == 'card_to_wallet':
-            if not data.get('card_id'):
-                raise serializers.ValidationError("حقل 'card_id' مطلوب.")
-            try:
-                card = CardDetail.objects.get(id=data['card_id'], user=user)
-                if card.balance < data['amount']:
-                    raise serializers.ValidationError("رصيد البطاقة غير كافٍ.")
-            except CardDetail.DoesNotExist:
-                raise serializers.ValidationError("البطاقة غير موجودة أو لا تخصك.")
-
-        if transaction_type == 'wallet_to_card':
-            if not data.get('card_id'):
-                raise serializers.ValidationError("حقل 'card_id' مطلوب.")
-            try:
-                card = CardDetail.objects.get(id=data['card_id'], user=user)
-            except CardDetail.DoesNotExist:
-                raise serializers.ValidationError("البطاقة غير موجودة أو لا تخصك.")
-            if user.total_balance < data['amount']:
-                raise serializers.ValidationError(f"رصيد المحفظة غير كافٍ. الرصيد الحالي: {user.total_balance} {data['currency']}")
+        # (ملكية البطاقة وكفاية الرصيد تُتحقق داخل الخصم المشروط في create)
+        if transaction_type in ['card_to_wallet', 'wallet_to_card'] and not data.get('card_id'):
+            raise serializers.ValidationError("حقل 'card_id' مطلوب.")
 
         # التحقق من التسليم المجدول
         if data.get('delivery_type') == 'scheduled':
@@ -1001,76 +1028,64 @@ class WalletTransactionSerializer(serializers.Serializer):
         recipient_lat = validated_data.get('recipient_latitude')
         recipient_lng = validated_data.get('recipient_longitude')
 
-        if recipient_lat and recipient_lng:
-            delivery_locations = DeliveryLocation.objects.select_related('delivery_agent').all()
-            min_distance = None
-            for location in delivery_locations:
-                if not location.delivery_agent.is_approved:
-                    continue
-                distance = haversine_distance(
-                    float(recipient_lat),
-                    float(recipient_lng),
-                    float(location.latitude),
-                    float(location.longitude)
-                )
-                if min_distance is None or distance < min_distance:
-                    min_distance = distance
-                    delivery_agent = location.delivery_agent
+        # التسليم المجدول يُسند لاحقًا دفعة واحدة لكل نافذة زمنية (assign_scheduled)
+        is_scheduled = validated_data.get('delivery_type') == 'scheduled'
+        if recipient_lat and recipient_lng and not is_scheduled:
+            delivery_agent = best_agent(recipient_lat, recipient_lng)
 
         # تحديد حالة المعاملة
         status = 'completed'
         if validated_data.get('delivery_type') == 'scheduled':
             status = 'pending_delivery'
 
+        # كل حركة رصيد استعلام UPDATE واحد مشروط (core/balances.py)
+        # والقيود المقابلة تُضاف إلى دفتر القيود (core/ledger.py)
+        # أخطاء الرصيد بنفس شكل أخطاء validate(): {"non_field_errors": [...]}
+        wallet = wallet_account(user.id)
+        card = card_account(validated_data.get('card_id'))
         with db_transaction.atomic():
             if transaction_type == 'deposit':
-                user.total_balance += amount
-                user.save(update_fields=['total_balance'])
+                credit_wallet(user.id, amount, sharded=user.sharded_balance)
+                legs = [(CASH, -amount), (wallet, amount)]
 
             elif transaction_type == 'withdrawal':
                 if validated_data['withdrawal_source'] == 'card':
-                    card = CardDetail.objects.get(id=validated_data['card_id'], user=user)
-                    card.balance -= amount
-                    card.save(update_fields=['balance'])
+                    withdraw_card(validated_data['card_id'], amount, user_id=user.id, currency=currency, error_key=NON_FIELD_ERRORS)
+                    legs = [(card, -amount), (CASH, amount)]
                 else:
-                    user.total_balance -= amount
-                    user.save(update_fields=['total_balance'])
+                    withdraw_wallet(user.id, amount, currency=currency, sharded=user.sharded_balance, error_key=NON_FIELD_ERRORS)
+                    legs = [(wallet, -amount), (CASH, amount)]
 
             elif transaction_type == 'send_money':
                 if validated_data['send_source'] == 'card':
-                    card = CardDetail.objects.get(id=validated_data['card_id'], user=user)
-                    card.balance -= amount
-                    card.save(update_fields=['balance'])
+                    withdraw_card(validated_data['card_id'], amount, user_id=user.id, currency=currency, error_key=NON_FIELD_ERRORS)
+                    source = card
                 else:
-                    user.total_balance -= amount
-                    user.save(update_fields=['total_balance'])
-
-                recipient.total_balance += amount
-                recipient.save(update_fields=['total_balance'])
+                    withdraw_wallet(user.id, amount, currency=currency, sharded=user.sharded_balance, error_key=NON_FIELD_ERRORS)
+                    source = wallet
+                credit_wallet(recipient.id, amount, sharded=recipient.sharded_balance)
+                legs = [(source, -amount), (wallet_account(recipient.id), amount)]
 
             elif transaction_type == 'receive_money':
-                sender = User.objects.get(id=validated_data['recipient_id'])
-                if sender.total_balance < amount:
+                # المستخدم في recipient_id هو المرسل في حالة الاستلام
+                if recipient is None:
+                    raise serializers.ValidationError("حقل 'recipient_id' مطلوب عند استلام الأموال.")
+                try:
+                    withdraw_wallet(recipient.id, amount, sharded=recipient.sharded_balance)
+                except InsufficientFunds:
                     raise serializers.ValidationError("رصيد المرسل غير كافٍ.")
-                sender.total_balance -= amount
-                sender.save(update_fields=['total_balance'])
-
-                user.total_balance += amount
-                user.save(update_fields=['total_balance'])
+                credit_wallet(user.id, amount, sharded=user.sharded_balance)
+                legs = [(wallet_account(recipient.id), -amount), (wallet, amount)]
 
             elif transaction_type == 'card_to_wallet':
-                card = CardDetail.objects.get(id=validated_data['card_id'], user=user)
-                card.balance -= amount
-                card.save(update_fields=['balance'])
-                user.total_balance += amount
-                user.save(update_fields=['total_balance'])
+                withdraw_card(validated_data['card_id'], amount, user_id=user.id, currency=currency, error_key=NON_FIELD_ERRORS)
+                credit_wallet(user.id, amount, sharded=user.sharded_balance)
+                legs = [(card, -amount), (wallet, amount)]
 
             elif transaction_type == 'wallet_to_card':
-                user.total_balance -= amount
-                user.save(update_fields=['total_balance'])
-                card = CardDetail.objects.get(id=validated_data['card_id'], user=user)
-                card.balance += amount
-                card.save(update_fields=['balance'])
+                withdraw_wallet(user.id, amount, currency=currency, sharded=user.sharded_balance, error_key=NON_FIELD_ERRORS)
+                deposit_card(validated_data['card_id'], amount, user_id=user.id, error_key=NON_FIELD_ERRORS)
+                legs = [(wallet, -amount), (card, amount)]
 
             # ✅ إنشاء المعاملة مع الحقول الجديدة
             transaction = Transaction.objects.create(
@@ -1087,9 +1102,18 @@ class WalletTransactionSerializer(serializers.Serializer):
                 delivery_date=validated_data.get('delivery_date'),
                 delivery_time=validated_data.get('delivery_time'),
                 delivery_agent=delivery_agent,
+                delivery_status='assigned' if delivery_agent else 'pending',
                 status=status
             )
-
+            ledger.post(legs, transaction=transaction)
+            rollups.record([transaction])
+            if delivery_agent:
+                increment_workload(delivery_agent.id)
+
+        source_field = {'withdrawal': 'withdrawal_source', 'send_money': 'send_source'}.get(transaction_type)
+        if source_field is None or validated_data[source_field] == 'wallet':
+            # رصيد المحفظة تغير في قاعدة البيانات مباشرة؛ نحدّث نسخة المستخدم للاستجابة
+            user.total_balance = wallet_balance(user.id, sharded=user.sharded_balance)
         return transaction
 
 # serializers.py
@@ -0,0 +1,67 @@
+# core/statements.py
+
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+COLUMNS = [
+    'id',
+    'timestamp',
+    'transaction_type',
+    'amount',
+    'currency_from',
+    'amount_to',
+    'currency_to',
+    'status',
+    'user_id',
+    'recipient_id',
+]
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def statement_rows(queryset, start=None, end=None, chunk_size=None):
+    """
+    صفوف الكشف بالترتيب الزمني كـ tuples (values_list) عبر iterator:
+    مؤشر من جهة الخادم يجلب chunk_size صفًا في كل مرة، فالذاكرة ثابتة مهما كان عدد الصفوف.
+    start و end تاريخان (يوم النهاية مشمول).
+    """
+    if start:
+        queryset = queryset.filter(timestamp__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        queryset = queryset.filter(
+            timestamp__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+        )
+    chunk_size = chunk_size or getattr(settings, 'STATEMENT_CHUNK_SIZE', 2000)
+    return queryset.order_by('timestamp', 'id').values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    # كائن "ملف" يُرجع السطر بدل كتابته، ليُستخدم مع csv.writer في البث
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield '﻿' + writer.writerow(COLUMNS)  # BOM ليفتح Excel الملف بترميز UTF-8
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+RENDERERS = {
+    'csv': csv_lines,
+    'ndjson': ndjson_lines,
+}
@@ -1,3 +1,500 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import User, BalanceShard, BalanceSnapshot, CardDetail, DailyRollup, Transaction, QueuedTransaction
+from .balances import compact_shards, credit_wallet, debit_card, debit_wallet, wallet_balance
+from .ledger import balance_as_of, card_account, take_snapshots
+from . import dispatch, rollups, views
+from .assignment import _apply
+from .locations import location_store
+from .postings import claim_batch, enqueue, process
+from .routing import plan_route
+
+
+class DeliveryActionsTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner', email='owner@x.com', status='verified')
+        self.agent = User.objects.create(
+            username='agent', email='agent@x.com', status='verified', role='delivery'
+        )
+        self.transaction = Transaction.objects.create(user=self.owner, amount=10, delivery_status='pending')
+
+    def test_actions_are_routed_to_transaction_viewset(self):
+        for name in ('transaction-assign-to-me', 'transaction-mark-delivered'):
+            match = resolve(reverse(name, args=[self.transaction.pk]))
+            self.assertIs(match.func.cls, views.TransactionViewSet)
+
+    def test_assign_to_me_updates_workload(self):
+        # المندوب يرى فقط المعاملات المرتبطة به (visible_transactions)
+        Transaction.objects.filter(pk=self.transaction.pk).update(delivery_agent=self.agent)
+        client = APIClient()
+        client.force_authenticate(self.agent)
+
+        response = client.post(f'/api/transactions/{self.transaction.pk}/assign_to_me/')
+
+        self.assertEqual(response.status_code, 200)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.delivery_status, 'assigned')
+        self.agent.refresh_from_db()
+        self.assertEqual(self.agent.active_deliveries, 1)
+
+    def test_mark_delivered_completes_transaction(self):
+        Transaction.objects.filter(pk=self.transaction.pk).update(
+            delivery_agent=self.agent, delivery_status='assigned'
+        )
+        User.objects.filter(pk=self.agent.pk).update(active_deliveries=1)
+        client = APIClient()
+        client.force_authenticate(self.agent)
+
+        response = client.post(f'/api/transactions/{self.transaction.pk}/mark_delivered/')
+
+        self.assertEqual(response.status_code, 200)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.delivery_status, 'delivered')
+        self.agent.refresh_from_db()
+        self.assertEqual(self.agent.active_deliveries, 0)
+
+
+@override_settings(LOCATION_FLUSH_INTERVAL=3600)
+class DispatchIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.agent = User.objects.create(username='a', email='a@x.com', status='verified', role='delivery')
+        patcher = mock.patch.object(location_store, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(location_store.flush)
+        self.addCleanup(setattr, dispatch, '_index', None)
+
+    def test_fresh_index_sees_position_not_yet_flushed(self):
+        # عملية لم تبنِ الفهرس بعد: النبضة لا تصل للفهرس ولا للجدول حتى التفريغ
+        dispatch._index = None
+        location_store.record(self.agent.id, 25.2, 55.3)
+
+        self.assertEqual(dispatch.closest_agent(25.2, 55.3), self.agent)
+
+
+class ScheduledAssignmentTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner', email='owner@x.com', status='verified')
+        self.agent = User.objects.create(username='a', email='a@x.com', status='verified', role='delivery')
+        self.other = User.objects.create(username='b', email='b@x.com', status='verified', role='delivery')
+        self.free = Transaction.objects.create(user=self.owner, amount=10)
+        self.taken = Transaction.objects.create(user=self.owner, amount=10)
+
+    def test_assignment_made_meanwhile_is_not_overwritten(self):
+        # assign_to_me ثبّت إسنادًا بين قراءة النافذة وحفظ الإسناد الجماعي
+        Transaction.objects.filter(pk=self.taken.pk).update(delivery_agent=self.other, delivery_status='assigned')
+
+        applied = _apply([(self.free.id, self.agent.id, 1.0), (self.taken.id, self.agent.id, 1.0)])
+
+        self.assertEqual(applied, {self.free.id})
+        self.taken.refresh_from_db()
+        self.assertEqual(self.taken.delivery_agent_id, self.other.id)
+        self.agent.refresh_from_db()
+        self.assertEqual(self.agent.active_deliveries, 1)
+
+
+class PostingProcessTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified', total_balance=100)
+        self.recipient = User.objects.create(username='r', email='r@x.com', status='verified')
+        self.payload = {'transaction_type': 'send_money', 'amount': '30', 'send_source': 'wallet', 'recipient_id': self.recipient.id}
+
+    def test_posting_and_completion_commit_together(self):
+        enqueue(self.user, 'wallet', self.payload)
+        item, = claim_batch(10)
+
+        process(item)
+
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'completed')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_item_no_longer_claimed_is_not_posted_again(self):
+        enqueue(self.user, 'wallet', self.payload)
+        stale, = claim_batch(10)
+        # requeue_stale أعادها للطابور وحجزها عامل آخر قبل أن يكمل العامل الأول
+        QueuedTransaction.objects.filter(pk=stale.pk).update(status='queued')
+        current, = claim_batch(10)
+
+        process(current)
+        process(stale)
+
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_balance, 70)
+
+
+class ConditionalDebitTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified', total_balance=100)
+        self.other = User.objects.create(username='o', email='o@x.com', status='verified')
+        self.card = CardDetail.objects.create(user=self.user, balance=50)
+        self.other_card = CardDetail.objects.create(user=self.other, balance=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def transfer(self, **overrides):
+        body = {
+            'transaction_type': 'send_money', 'amount': '40', 'currency_from': 'AED', 'currency_to': 'AED',
+            'card_id': self.card.id, 'recipient_id': self.other.id,
+            'sender_latitude': '25.2', 'sender_longitude': '55.3',
+            'recipient_latitude': '25.1', 'recipient_longitude': '55.2',
+        }
+        body.update(overrides)
+        return self.client.post('/api/transfers/', body, format='json')
+
+    def test_debit_succeeds_when_balance_is_enough(self):
+        self.assertTrue(debit_wallet(self.user.id, 100))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_balance, 0)
+
+    def test_debit_fails_without_changing_balance(self):
+        self.assertFalse(debit_wallet(self.user.id, 101))
+        self.assertFalse(debit_card(self.card.id, 51))
+        self.user.refresh_from_db()
+        self.card.refresh_from_db()
+        self.assertEqual((self.user.total_balance, self.card.balance), (100, 50))
+
+    def test_wallet_insufficient_funds_keeps_non_field_errors_shape(self):
+        response = self.client.post('/api/wallet/transaction/', {
+            'transaction_type': 'withdrawal', 'amount': '150', 'withdrawal_source': 'wallet',
+            'sender_latitude': '25.2', 'sender_longitude': '55.3',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_transfer_card_insufficient_funds_keeps_error_shape(self):
+        response = self.transfer(amount='60')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, 50)
+
+    def test_transfer_rejects_card_of_another_user(self):
+        response = self.transfer(card_id=self.other_card.id)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "لا يمكنك استخدام بطاقة لا تخصك."})
+
+    def test_transfer_debits_sender_card(self):
+        response = self.transfer()
+
+        self.assertEqual(response.status_code, 201)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, 10)
+
+
+class ShardedBalanceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='hot', email='hot@x.com', status='verified', total_balance=10, sharded_balance=True
+        )
+
+    def test_credit_goes_to_shards_and_counts_in_balance(self):
+        credit_wallet(self.user.id, 30, sharded=True)
+        credit_wallet(self.user.id, 20, sharded=True)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_balance, 10)
+        self.assertEqual(wallet_balance(self.user.id, sharded=True), 60)
+        self.assertEqual(wallet_balance(self.user.id), 10)
+
+    def test_compaction_moves_shards_into_balance(self):
+        credit_wallet(self.user.id, 30, sharded=True)
+
+        self.assertEqual(compact_shards(self.user.id), 30)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_balance, 40)
+        self.assertFalse(BalanceShard.objects.filter(user=self.user).exclude(balance=0).exists())
+        self.assertEqual(wallet_balance(self.user.id, sharded=True), 40)
+
+    def test_debit_over_base_balance_compacts_first(self):
+        credit_wallet(self.user.id, 30, sharded=True)
+
+        self.assertTrue(debit_wallet(self.user.id, 35, sharded=True))
+        self.assertFalse(debit_wallet(self.user.id, 10, sharded=True))
+        self.assertEqual(wallet_balance(self.user.id, sharded=True), 5)
+
+
+class BulkTransferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified', total_balance=100)
+        self.first = User.objects.create(username='a', email='a@x.com', status='verified')
+        self.second = User.objects.create(username='b', email='b@x.com', status='verified')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, *amounts):
+        rows = [{'recipient_id': recipient.id, 'amount': amount}
+                for recipient, amount in zip((self.first, self.second), amounts)]
+        return self.client.post('/api/transfers/bulk/', {'rows': rows}, format='json')
+
+    def test_batch_pays_every_row(self):
+        response = self.pay('30', '20')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['completed'], 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_balance, 50)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_batch_over_balance_pays_nobody(self):
+        response = self.pay('60', '50')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 0)
+        self.first.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.total_balance, self.first.total_balance), (100, 0))
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified', total_balance=1000)
+        self.recipient = User.objects.create(username='r', email='r@x.com', status='verified')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, amount='100', key='pay-1', query=''):
+        return self.client.post(
+            f'/api/transfers/bulk/{query}',
+            {'rows': [{'recipient_id': self.recipient.id, 'amount': amount}]},
+            format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def assert_paid_once(self):
+        self.user.refresh_from_db()
+        self.recipient.refresh_from_db()
+        self.assertEqual((self.user.total_balance, self.recipient.total_balance), (900, 100))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_retry_replays_stored_response(self):
+        first = self.pay()
+        retry = self.pay()
+
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assert_paid_once()
+
+    def test_same_key_with_different_payload_is_rejected(self):
+        self.pay()
+
+        response = self.pay(amount='50')
+
+        self.assertEqual(response.status_code, 422)
+        self.assert_paid_once()
+
+    def test_retry_after_client_disconnect_is_not_paid_again(self):
+        # العميل قطع الاتصال قبل قراءة الاستجابة: الدفعة ثُبِّتت والمفتاح محفوظ
+        self.pay(query='?stream=1').close()
+
+        retry = self.pay(query='?stream=1')
+
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assert_paid_once()
+
+    def test_failed_request_frees_the_key(self):
+        self.assertEqual(self.pay(amount='5000').status_code, 400)
+
+        response = self.pay(amount='5000')
+
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+@mock.patch('core.quotes.get_exchange_rate', return_value=0.25)
+class FXQuoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified')
+        self.other = User.objects.create(username='o', email='o@x.com', status='verified')
+        self.card = CardDetail.objects.create(user=self.user, balance=500)
+        CardDetail.objects.create(user=self.other, balance=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def quote(self):
+        response = self.client.post('/api/transfers/quote/', {
+            'amount': '100', 'currency_from': 'AED', 'currency_to': 'USD'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['quote_token']
+
+    def transfer(self, token, amount='100'):
+        return self.client.post('/api/transfers/', {
+            'transaction_type': 'send_money', 'amount': amount, 'currency_from': 'AED', 'currency_to': 'USD',
+            'card_id': self.card.id, 'recipient_id': self.other.id, 'quote_token': token,
+            'sender_latitude': '25.2', 'sender_longitude': '55.3',
+            'recipient_latitude': '25.1', 'recipient_longitude': '55.2',
+        }, format='json')
+
+    def test_quote_can_be_reused_at_the_locked_rate(self, rate):
+        token = self.quote()
+        rate.return_value = 0.5
+
+        for _ in range(2):
+            response = self.transfer(token)
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(Transaction.objects.values_list('amount_to', flat=True)), [Decimal('25.00')] * 2
+        )
+
+    def test_expired_quote_is_rejected(self, rate):
+        token = self.quote()
+
+        with mock.patch('time.time', return_value=time.time() + 61):
+            response = self.transfer(token)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quote_token', response.json())
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_quote_must_match_amount_and_owner(self, rate):
+        token = self.quote()
+
+        self.assertIn('quote_token', self.transfer(token, amount='90').json())
+        self.client.force_authenticate(self.other)
+        self.assertIn('quote_token', self.transfer(token).json())
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+class CardLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_card_created_with_balance_gets_opening_entry(self):
+        response = self.client.post('/api/cards/', {
+            'card_number': '4111111111111111', 'expiry': '2030-01-01', 'balance': '250.00'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(balance_as_of(card_account(response.json()['id'])), 250)
+
+    def test_manual_balance_change_is_posted_as_adjustment(self):
+        card = CardDetail.objects.create(user=self.user, balance=0)
+
+        response = self.client.patch(f'/api/cards/{card.id}/', {'balance': '80.00'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(balance_as_of(card_account(card.id)), 80)
+
+    def test_snapshots_continue_from_latest_balance(self):
+        card = CardDetail.objects.create(user=self.user, balance=0)
+        self.client.patch(f'/api/cards/{card.id}/', {'balance': '80.00'}, format='json')
+        self.assertEqual(take_snapshots(as_of=timezone.now()), 2)
+        self.client.patch(f'/api/cards/{card.id}/', {'balance': '50.00'}, format='json')
+        take_snapshots(as_of=timezone.now() + timedelta(seconds=1))
+
+        latest = BalanceSnapshot.objects.filter(account=card_account(card.id)).order_by('-as_of').first()
+        self.assertEqual(latest.balance, 50)
+        self.assertEqual(balance_as_of(card_account(card.id)), 50)
+
+
+class StreamTokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified')
+        self.transaction = Transaction.objects.create(user=self.user, amount=10)
+        self.other = Transaction.objects.create(user=self.user, amount=20)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stream_token_authenticates_only_its_transaction(self):
+        response = self.client.post(f'/api/transactions/{self.transaction.pk}/track/stream-token/')
+        self.assertEqual(response.status_code, 200)
+        token = response.json()['token']
+
+        request = RequestFactory().get('/', {'token': token})
+        self.assertEqual(views._authenticate_stream(request, self.transaction.pk), self.user)
+        self.assertIsNone(views._authenticate_stream(request, self.other.pk))
+
+    def test_raw_jwt_in_query_string_is_rejected(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        request = RequestFactory().get('/', {'token': str(AccessToken.for_user(self.user))})
+        self.assertIsNone(views._authenticate_stream(request, self.transaction.pk))
+
+
+class RollupRebuildTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified')
+        self.other = User.objects.create(username='o', email='o@x.com', status='verified')
+
+    def test_rebuild_matches_live_rollups(self):
+        transactions = [
+            Transaction.objects.create(user=self.user, amount=10, transaction_type='deposit', currency_from='AED'),
+            Transaction.objects.create(user=self.user, amount=5, transaction_type='deposit', currency_from='AED'),
+            Transaction.objects.create(user=self.other, amount=7, transaction_type='withdrawal', currency_from='AED'),
+        ]
+        rollups.record(transactions)
+        live = sorted(DailyRollup.objects.values_list('user_id', 'transaction_type', 'total', 'count'))
+
+        self.assertEqual(rollups.rebuild(), 2)
+        self.assertEqual(sorted(DailyRollup.objects.values_list('user_id', 'transaction_type', 'total', 'count')), live)
+
+    def test_rebuild_of_one_user_leaves_others(self):
+        rollups.record([Transaction.objects.create(user=self.other, amount=7, transaction_type='deposit')])
+        DailyRollup.objects.filter(user=self.other).update(total=99)
+
+        rollups.rebuild(user_id=self.user.id)
+
+        self.assertEqual(DailyRollup.objects.get(user=self.other).total, 99)
+
+    def test_pending_payment_is_counted_by_type(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/delivery/payment/', {
+            'amount': '12.50', 'currency_from': 'AED', 'currency_to': 'AED'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        rollup = DailyRollup.objects.get(user=self.user)
+        self.assertEqual((rollup.transaction_type, rollup.total, rollup.count), ('deposit', Decimal('12.50'), 1))
+
+    def test_payment_with_invalid_amount_is_rejected(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/delivery/payment/', {
+            'amount': 'abc', 'currency_from': 'AED', 'currency_to': 'AED'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+class RoutePlanTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u', email='u@x.com', status='verified')
+        self.transactions = [
+            Transaction.objects.create(user=self.user, amount=10, recipient_latitude=25.0 + step / 100,
+                                       recipient_longitude=55.0)
+            for step in (1, 2, 3)
+        ]
+
+    def test_cached_order_is_measured_from_current_position(self):
+        first = plan_route(1, (25.0, 55.0), self.transactions)
+        # المندوب وصل للمحطة الأولى: نفس الترتيب من الكاش، والمسافات من موقعه الجديد
+        moved = plan_route(1, (25.01, 55.0), self.transactions)
+
+        self.assertEqual([t.id for t, _, _ in moved], [t.id for t, _, _ in first])
+        self.assertAlmostEqual(moved[0][1], 0.0)
+        self.assertAlmostEqual(moved[-1][2], first[-1][2] - first[0][1])
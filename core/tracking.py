@@ -0,0 +1,83 @@
+# core/tracking.py
+
+import asyncio
+import threading
+from collections import defaultdict
+
+from .geo import haversine_many
+from .eta import agent_speed, eta_minutes
+
+
+def tracking_payload(transaction, position):
+    """
+    بيانات تتبع المعاملة لموقع مندوب معين (نفس شكل استجابة track).
+    """
+    distance = float(haversine_many(
+        transaction.recipient_latitude,
+        transaction.recipient_longitude,
+        [position.latitude],
+        [position.longitude]
+    )[0])
+    speed = agent_speed(position.agent_id)
+
+    return {
+        "current_location": {
+            "latitude": position.latitude,
+            "longitude": position.longitude,
+            "updated_at": position.updated_at
+        },
+        "destination": {
+            "latitude": transaction.recipient_latitude,
+            "longitude": transaction.recipient_longitude
+        },
+        "distance_to_destination_km": round(distance, 2),
+        "estimated_time_minutes": round(eta_minutes(distance, speed), 1),
+        "average_speed_kmh": round(speed, 1),
+        "delivery_status": transaction.delivery_status
+    }
+
+
+def _offer(queue, position):
+    # نحتفظ بآخر موقع فقط: المشاهد البطيء لا يحتاج المواقع القديمة
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(position)
+
+
+class LocationBroadcaster:
+    """
+    توزيع تحديثات مواقع المندوبين على بثوث التتبع المفتوحة داخل العملية.
+    كل تحديث موقع يُرسل مرة واحدة إلى جميع المشاهدين لنفس المندوب.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)  # agent_id -> {(loop, queue)}
+        self._lock = threading.Lock()
+
+    def subscribe(self, agent_id):
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=1))
+        with self._lock:
+            self._subscribers[agent_id].add(entry)
+        return entry
+
+    def unsubscribe(self, agent_id, entry):
+        with self._lock:
+            subscribers = self._subscribers.get(agent_id)
+            if subscribers is not None:
+                subscribers.discard(entry)
+                if not subscribers:
+                    del self._subscribers[agent_id]
+
+    def publish(self, position):
+        # قد تُستدعى من خيط متزامن (WSGI/sync view)، لذا نمرر عبر call_soon_threadsafe
+        with self._lock:
+            subscribers = list(self._subscribers.get(position.agent_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, position)
+            except RuntimeError:
+                # الحلقة أُغلقت؛ سيُزال المشترك عند انتهاء البث
+                pass
+
+
+broadcaster = LocationBroadcaster()
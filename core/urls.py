@@ -37,7 +37,14 @@ urlpatterns = [
     # Transfers (send/receive money)
     # -------------------------------
     path('api/transfers/', views.TransferTransactionView.as_view(), name='transfer-create'),
+    path('api/transfers/bulk/', views.BulkTransferView.as_view(), name='transfer-bulk'),
+    path('api/transfers/quote/', views.FXQuoteView.as_view(), name='transfer-quote'),
+    path('api/activity/', views.ActivityFeedView.as_view(), name='activity-feed'),
+    path('api/transactions/statement/', views.StatementExportView.as_view(), name='transaction-statement'),
+    path('api/postings/<int:pk>/', views.PostingStatusView.as_view(), name='posting-status'),
     path('api/delivery/transactions/', views.DeliveryTransactionView.as_view(), name='delivery-transactions'),
+    path('api/delivery/route/', views.DeliveryRouteView.as_view(), name='delivery-route'),
+    path('api/transactions/<int:pk>/track/stream/', views.track_delivery_stream, name='transaction-track-stream'),
     path('api/users/balances/', views.GetAllBalancesView.as_view(), name='user-balances'),
     path('api/users/me/balance/', views.MyBalanceView.as_view(), name='my-balance'),
     # -------------------------------
@@ -1,6 +1,6 @@
 # core/views.py
 
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
@@ -8,14 +8,28 @@ from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.shortcuts import get_object_or_404
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from django.core.exceptions import ValidationError
+from django.db import transaction as db_transaction
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.urls import reverse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+import asyncio
+import json
 
 # --- النماذج ---from .serializers import DeliveryLocationSerializer
-from .models import User, CardDetail, Transaction, DigitalSignature,DeliveryLocation,GuestUser
+from .models import User, CardDetail, Transaction, DigitalSignature,DeliveryLocation,GuestUser,QueuedTransaction
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 import secrets
+import hashlib
 from .models import generate_otp ,EmailOTP
 from .utils2 import send_otp_email  # ✅ الاستيراد هنا
 from rest_framework.decorators import api_view,permission_classes
@@ -40,10 +54,28 @@ from .serializers import (
     EmployeeListSerializer,
     WalletTransactionSerializer,
     MyBalanceSerializer,
-    UserBalanceSerializer,
-    haversine_distance,
+    BulkDeliveryLocationSerializer,
+    BulkTransferSerializer,
+    FXQuoteSerializer,
+    ActivitySerializer,
     
 )
+from .locations import location_store
+from .dispatch import ACTIVE_DELIVERY_STATUSES, increment_workload, decrement_workload
+from .routing import plan_route
+from .tracking import broadcaster, tracking_payload
+from .eta import agent_speed, eta_minutes
+from .ledger import balance_as_of, wallet_account
+from .balances import wallet_balance
+from .payroll import run_bulk_transfer
+from .idempotency import idempotent
+from .postings import wants_async, enqueue, wallet_result
+from .quotes import create_quote
+from .pagination import TransactionCursorPagination, BalanceKeysetPagination, estimated_count
+from .activity import activity_feed
+from .rollups import PERIODS, record as record_rollups, summarize
+from .statements import CONTENT_TYPES, RENDERERS, statement_rows
+from rest_framework.utils.urls import replace_query_param
 
 # --- الصلاحيات المخصصة ---
 from .permissions import IsAdminUser, IsApprovedUser, IsDeliveryStaff
@@ -174,11 +206,8 @@ class LoginView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # ✅ تخزين/تحديث موقع المندوب (upsert)
-            DeliveryLocation.objects.update_or_create(
-                delivery_agent=user,
-                defaults={"latitude": lat, "longitude": lng}
-            )
+            # ✅ تخزين موقع المندوب في المخزن الساخن (يُكتب لاحقًا دفعة واحدة)
+            location_store.record(user.id, lat, lng)
 
         refresh = RefreshToken.for_user(user)
         return Response({
@@ -294,11 +323,35 @@ class DeliveryLocationViewSet(viewsets.ModelViewSet):
         return DeliveryLocation.objects.filter(delivery_agent=self.request.user)
 
     def perform_create(self, serializer):
-        # ربط الموقع بالمندوب تلقائيًا
-        serializer.save(delivery_agent=self.request.user)
+        # ربط الموقع بالمندوب تلقائيًا عبر المخزن الساخن (بدون كتابة متزامنة)
+        serializer.instance = location_store.record(
+            self.request.user.id,
+            serializer.validated_data['latitude'],
+            serializer.validated_data['longitude']
+        )
 
     def perform_update(self, serializer):
-        serializer.save(delivery_agent=self.request.user)
+        self.perform_create(serializer)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        رفع دفعة نقاط GPS بتوقيتها في طلب واحد.
+        أحدث نقطة تصبح الموقع الحي، والباقي يُضاف إلى سجل المواقع.
+        """
+        serializer = BulkDeliveryLocationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        points = serializer.validated_data['points']
+
+        position = location_store.ingest(request.user.id, points)
+        return Response({
+            "accepted": len(points),
+            "current_location": {
+                "latitude": position.latitude,
+                "longitude": position.longitude,
+                "updated_at": position.updated_at
+            }
+        }, status=status.HTTP_201_CREATED)
 # ================================
 # 4. إدارة البطاقات
 # ================================
@@ -323,27 +376,51 @@ class CardDetailViewSet(viewsets.ModelViewSet):
 # ================================
 # 5. المعاملات (سحب، إيداع، تحويل)
 # ================================
+def visible_transactions(user):
+    """
+    المعاملات التي يحق للمستخدم رؤيتها حسب دوره.
+    """
+    # ✅ إذا كان المدير (admin) → يرى جميع المعاملات
+    if user.role == 'admin':
+        return Transaction.objects.all().order_by('-timestamp')
+
+    # ✅ إذا كان مندوب التسليم → يرى المعاملات المسندة إليه فقط
+    if user.role == 'delivery':
+        return Transaction.objects.filter(
+            delivery_agent=user
+        ).order_by('-timestamp')
+
+    # ✅ إذا كان مستخدمًا عاديًا → يرى معاملاته فقط
+    return Transaction.objects.filter(user=user).order_by('-timestamp')
+
+
+def date_range(request):
+    """
+    مدى التواريخ من ?from= و ?to= (YYYY-MM-DD، كلاهما اختياري).
+    """
+    dates = []
+    for param in ('from', 'to'):
+        value = request.query_params.get(param)
+        try:
+            day = parse_date(value) if value else None
+        except ValueError:
+            day = None
+        if value and day is None:
+            raise serializers.ValidationError({"error": "صيغة التاريخ غير صحيحة، استخدم YYYY-MM-DD."})
+        dates.append(day)
+    return dates
+
+
 class TransactionViewSet(viewsets.ModelViewSet):
     """
     إدارة المعاملات (مثل السحب أو الإيداع أو التحويل).
     """
     serializer_class = TransactionSerializer
     permission_classes = [IsApprovedUser]
+    pagination_class = TransactionCursorPagination
 
     def get_queryset(self):
-        user = self.request.user
-          # ✅ إذا كان المدير (admin) → يرى جميع المعاملات
-        if user.role == 'admin':
-            return Transaction.objects.all().order_by('-timestamp')
-
-        # ✅ إذا كان مندوب التسليم → يرى المعاملات المسندة إليه فقط
-        if user.role == 'delivery':
-            return Transaction.objects.filter(
-                delivery_agent=user
-            ).order_by('-timestamp')
-
-        # ✅ إذا كان مستخدمًا عاديًا → يرى معاملاته فقط
-        return Transaction.objects.filter(user=user).order_by('-timestamp')
+        return visible_transactions(self.request.user)
     @action(detail=True, methods=['get'], url_path='track')
     def track_delivery(self, request, pk=None):
         """
@@ -357,40 +434,37 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 status=404
             )
 
-        delivery_location = getattr(transaction.delivery_agent, 'location', None)
+        delivery_location = location_store.get(transaction.delivery_agent_id)
         if not delivery_location:
             return Response(
                 {"error": "المندوب لم يُفعّل تتبع الموقع بعد."},
                 status=404
             )
 
-        # حساب المسافة من المندوب إلى المستقبل
-        distance = haversine_distance(
-            float(transaction.recipient_latitude),
-            float(transaction.recipient_longitude),
-            float(delivery_location.latitude),
-            float(delivery_location.longitude)
-        )
-
+        # حساب المسافة والوقت المتوقع من المندوب إلى المستقبل
         return Response({
             "delivery_agent": {
                 "id": transaction.delivery_agent.id,
                 "full_name": f"{transaction.delivery_agent.first_name} {transaction.delivery_agent.last_name}",
                 "phone_number": transaction.delivery_agent.phone_number,
             },
-            "current_location": {
-                "latitude": delivery_location.latitude,
-                "longitude": delivery_location.longitude,
-                "updated_at": delivery_location.updated_at
-            },
-            "destination": {
-                "latitude": transaction.recipient_latitude,
-                "longitude": transaction.recipient_longitude
-            },
-            "distance_to_destination_km": round(distance, 2),
-            "estimated_time_minutes": round(distance / 0.6, 1),  # افتراض سرعة 36 كم/ساعة
-            "delivery_status": transaction.delivery_status
-        })    
+            **tracking_payload(transaction, delivery_location)
+        })
+    @action(detail=True, methods=['post'], url_path='track/stream-token')
+    def stream_token(self, request, pk=None):
+        """
+        رمز قصير العمر لفتح بث التتبع المباشر (EventSource) لهذه المعاملة.
+        """
+        transaction = self.get_object()
+        ttl = getattr(settings, 'TRACKING_STREAM_TOKEN_TTL', 60)
+        token = issue_stream_token(request.user, transaction)
+        stream_url = reverse('transaction-track-stream', args=[transaction.pk])
+        return Response({
+            "token": token,
+            "expires_in": ttl,
+            "stream_url": request.build_absolute_uri(f"{stream_url}?token={token}")
+        })
+
     @action(detail=False, methods=['get'], url_path='credit')
     def credit_transactions(self, request):
         """
@@ -401,8 +475,9 @@ class TransactionViewSet(viewsets.ModelViewSet):
             user=request.user,
             transaction_type__in=credit_types
         )
-        serializer = self.get_serializer(transactions, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(transactions)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'], url_path='debit')
     def debit_transactions(self, request):
@@ -414,8 +489,28 @@ class TransactionViewSet(viewsets.ModelViewSet):
             user=request.user,
             transaction_type__in=debit_types
         )
-        serializer = self.get_serializer(transactions, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(transactions)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request):
+        """
+        مجموع الإيداعات والخصومات لكل يوم/أسبوع/شهر (?period=) من الملخصات اليومية فقط.
+        مثل credit و debit تُحتسب المعاملات حسب نوعها أيًا كانت حالتها (ومنها الدفعات pending).
+        ?from= و ?to= لتحديد المدى (YYYY-MM-DD).
+        """
+        period = request.query_params.get('period', 'day')
+        if period not in PERIODS:
+            return Response(
+                {"error": "قيمة period يجب أن تكون day أو week أو month."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end = date_range(request)
+        return Response({
+            "period": period,
+            "results": list(summarize(request.user, period, start, end))
+        })
 
     # ✅ إذا كان مندوب تسليم، يرى جميع المعاملات بحالة 'pending'
         if hasattr(user, 'role') and user.role == 'delivery':
@@ -443,9 +538,14 @@ class TransactionViewSet(viewsets.ModelViewSet):
         if transaction.delivery_status != 'pending':
             return Response({'error': 'هذه المعاملة غير متاحة للتسليم'}, status=400)
 
-        transaction.delivery_agent = request.user
-        transaction.delivery_status = 'assigned'
-        transaction.save(update_fields=['delivery_agent', 'delivery_status'])
+        # ✅ تحديث شرطي لمنع أخذ نفس المعاملة من مندوبَين في نفس الوقت
+        with db_transaction.atomic():
+            assigned = Transaction.objects.filter(
+                pk=transaction.pk, delivery_status='pending'
+            ).update(delivery_agent=request.user, delivery_status='assigned')
+            if not assigned:
+                return Response({'error': 'هذه المعاملة غير متاحة للتسليم'}, status=400)
+            increment_workload(request.user.id)
         return Response({'status': 'تم تعيين المعاملة لك'})
 
     @action(detail=True, methods=['post'], permission_classes=[IsDeliveryStaff])
@@ -460,23 +560,251 @@ class TransactionViewSet(viewsets.ModelViewSet):
         if transaction.delivery_status != 'assigned':
             return Response({'error': 'لا يمكن تسليم هذه المعاملة الآن'}, status=400)
 
-        transaction.delivery_status = 'delivered'
-        transaction.status = 'completed'
-        transaction.save(update_fields=['delivery_status', 'status'])
+        with db_transaction.atomic():
+            delivered = Transaction.objects.filter(
+                pk=transaction.pk, delivery_status='assigned'
+            ).update(delivery_status='delivered', status='completed')
+            if not delivered:
+                return Response({'error': 'لا يمكن تسليم هذه المعاملة الآن'}, status=400)
+            decrement_workload(request.user.id)
         return Response({'status': 'تم تسليم المعاملة بنجاح'})
 
 
+class ActivityFeedView(APIView):
+    """
+    سجل نشاط المستخدم: المعاملات المرسلة والمستلمة معًا، مع اتجاه كل معاملة (credit/debit).
+    الترقيم بالمؤشر: ?cursor= من حقل next في الصفحة السابقة.
+    """
+    permission_classes = [IsApprovedUser]
+
+    def get(self, request):
+        paginator = TransactionCursorPagination()
+        limit = paginator.get_page_size(request)
+        items, next_cursor = activity_feed(request.user, request.query_params.get('cursor'), limit)
+
+        next_url = None
+        if next_cursor:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        return Response({
+            "next": next_url,
+            "results": ActivitySerializer(items, many=True).data
+        })
+
+
+class StatementExportView(APIView):
+    """
+    تصدير كشف المعاملات كاملًا كبث CSV أو NDJSON (?as=csv أو ?as=ndjson).
+    ?from= و ?to= لتحديد المدى (YYYY-MM-DD). نفس صلاحيات قائمة المعاملات.
+    """
+    permission_classes = [IsApprovedUser]
+
+    def get(self, request):
+        # ?format= محجوز في DRF لاختيار الـ renderer
+        kind = request.query_params.get('as', 'csv')
+        if kind not in RENDERERS:
+            return Response(
+                {"error": "قيمة as يجب أن تكون csv أو ndjson."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end = date_range(request)
+
+        rows = statement_rows(visible_transactions(request.user), start, end)
+        response = StreamingHttpResponse(RENDERERS[kind](rows), content_type=CONTENT_TYPES[kind])
+        response['Content-Disposition'] = f'attachment; filename="statement.{kind}"'
+        return response
+
+
+class BulkTransferView(APIView):
+    """
+    تحويل جماعي (رواتب): مئات أو آلاف الصفوف (recipient_id, amount) في طلب واحد
+    ومعاملة قاعدة بيانات واحدة، مع تقرير لكل صف.
+    """
+    permission_classes = [IsApprovedUser]
+
+    @idempotent
+    def post(self, request):
+        serializer = BulkTransferSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        report = run_bulk_transfer(
+            request.user,
+            data['rows'],
+            currency=data['currency'],
+            source=data['source'],
+            card_id=data.get('card_id')
+        )
+        return Response(report, status=status.HTTP_201_CREATED)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def _tracking_events(transaction):
+    """
+    بث أحداث الموقع عند تغيّر موقع المندوب فقط.
+    التحديثات داخل نفس العملية تصل فورًا عبر broadcaster، وتحديثات
+    العمليات الأخرى تُلتقط بقراءة الكاش كل TRACKING_POLL_INTERVAL ثانية.
+    """
+    loop = asyncio.get_running_loop()
+    agent_id = transaction.delivery_agent_id
+    poll_interval = getattr(settings, 'TRACKING_POLL_INTERVAL', 5)
+    status_interval = getattr(settings, 'TRACKING_STATUS_CHECK_INTERVAL', 30)
+    deadline = loop.time() + getattr(settings, 'TRACKING_STREAM_MAX_SECONDS', 300)
+    next_status_check = loop.time() + status_interval
+
+    entry = broadcaster.subscribe(agent_id)
+    _, queue = entry
+    try:
+        position = await sync_to_async(location_store.get)(agent_id)
+        last_sent = None
+        timed_out = False
+        while loop.time() < deadline:
+            if position is not None and (position.latitude, position.longitude) != last_sent:
+                last_sent = (position.latitude, position.longitude)
+                yield _sse('location', tracking_payload(transaction, position))
+            elif timed_out:
+                yield ": keep-alive\n\n"
+
+            try:
+                position = await asyncio.wait_for(queue.get(), timeout=poll_interval)
+                timed_out = False
+            except asyncio.TimeoutError:
+                position = await sync_to_async(location_store.get)(agent_id)
+                timed_out = True
+
+            if loop.time() >= next_status_check:
+                next_status_check = loop.time() + status_interval
+                delivery_status = await sync_to_async(
+                    Transaction.objects.filter(pk=transaction.pk).values_list('delivery_status', flat=True).first
+                )()
+                if delivery_status == 'delivered':
+                    yield _sse('delivered', {"delivery_status": delivery_status})
+                    return
+                transaction.delivery_status = delivery_status
+    finally:
+        broadcaster.unsubscribe(agent_id, entry)
+
+
+def _stream_token_key(token):
+    # الرمز قادم من الرابط: نخزن بصمته فقط (طول ثابت وآمن لمفاتيح الكاش)
+    return f"tracking_stream_token_{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+def issue_stream_token(user, transaction):
+    """
+    رمز قصير العمر لبث تتبع معاملة واحدة فقط، بدل وضع JWT الكامل في الرابط
+    (روابط الطلبات تُحفظ في سجلات الوكلاء والخوادم).
+    """
+    token = secrets.token_urlsafe(24)
+    cache.set(
+        _stream_token_key(token),
+        {"user_id": user.id, "transaction_id": transaction.id},
+        timeout=getattr(settings, 'TRACKING_STREAM_TOKEN_TTL', 60)
+    )
+    return token
+
+
+def _authenticate_stream(request, pk):
+    # EventSource في المتصفح لا يرسل ترويسات، لذلك نقبل ?token= (رمز البث من stream-token)
+    raw_token = request.GET.get('token')
+    if raw_token:
+        grant = cache.get(_stream_token_key(raw_token))
+        if grant is None or grant["transaction_id"] != pk:
+            return None
+        return User.objects.filter(pk=grant["user_id"]).first()
+    result = JWTAuthentication().authenticate(request)
+    return result[0] if result else None
+
+
+async def track_delivery_stream(request, pk):
+    """
+    تتبع مباشر لموقع المندوب عبر Server-Sent Events (يتطلب خادم ASGI).
+    """
+    try:
+        user = await sync_to_async(_authenticate_stream)(request, pk)
+    except (InvalidToken, AuthenticationFailed):
+        user = None
+    if user is None or user.status != 'verified':
+        return JsonResponse({"error": "غير مصرح."}, status=401)
+
+    transaction = await sync_to_async(
+        visible_transactions(user).filter(pk=pk).first
+    )()
+    if transaction is None:
+        return JsonResponse({"error": "المعاملة غير موجودة"}, status=404)
+    if not transaction.delivery_agent_id:
+        return JsonResponse({"error": "لا يوجد مندوب مُعين لهذه المعاملة."}, status=404)
+
+    response = StreamingHttpResponse(
+        _tracking_events(transaction), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # ================================
 # 6. التحويلات (send_money / receive_money)
 # ================================
 class TransferTransactionView(APIView):
     permission_classes = [IsApprovedUser]
 
+    @idempotent
     def post(self, request):
         serializer = TransferSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
+        if wants_async(request):
+            return queued_response(enqueue(request.user, 'transfer', request.data))
         transaction = serializer.save(user=request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class FXQuoteView(APIView):
+    """
+    عرض سعر تحويل مثبت: المبلغ المحوَّل والعمولة تحت رمز قصير العمر
+    يُرسل لاحقًا مع /api/transfers/ كـ quote_token.
+    """
+    permission_classes = [IsApprovedUser]
+
+    def post(self, request):
+        serializer = FXQuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quote = create_quote(request.user, **serializer.validated_data)
+        quote.pop('user_id')
+        return Response(quote, status=status.HTTP_201_CREATED)
+
+
+def queued_response(queued):
+    status_url = reverse('posting-status', args=[queued.id])
+    response = Response({
+        "id": queued.id,
+        "status": queued.status,
+        "status_url": status_url
+    }, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = status_url
+    return response
+
+
+class PostingStatusView(APIView):
+    """
+    حالة معاملة في طابور الترحيل غير المتزامن (للمستخدم صاحب المعاملة).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        queued = get_object_or_404(QueuedTransaction, pk=pk, user=request.user)
+        return Response({
+            "id": queued.id,
+            "kind": queued.kind,
+            "status": queued.status,
+            "attempts": queued.attempts,
+            "transaction_id": queued.transaction_id,
+            "result": queued.result,
+            "created_at": queued.created_at,
+            "updated_at": queued.updated_at
+        })
 # ================================
 # 7. التحقق من الهوية (وجه + هوية)
 # ================================
@@ -553,10 +881,17 @@ class SignatureView(APIView):
             signature_data=signature_data
         )
 
-        # ✅ تحديث حالة المعاملة إلى "مكتملة"
-        transaction.delivery_status = 'delivered'
-        transaction.status = 'completed'
-        transaction.save(update_fields=['delivery_status', 'status'])
+        # ✅ تحديث حالة المعاملة إلى "مكتملة" وتحرير حمل المندوب إن كانت نشطة
+        with db_transaction.atomic():
+            was_active = Transaction.objects.filter(
+                pk=transaction.pk, delivery_status__in=ACTIVE_DELIVERY_STATUSES
+            ).update(delivery_status='delivered', status='completed')
+            if was_active:
+                decrement_workload(transaction.delivery_agent_id)
+            else:
+                transaction.delivery_status = 'delivered'
+                transaction.status = 'completed'
+                transaction.save(update_fields=['delivery_status', 'status'])
 
         return Response({
             "message": "تم التوقيع وإكمال المعاملة بنجاح.",
@@ -585,16 +920,25 @@ class PaymentView(APIView):
                 {"error": "الرجاء إدخال المبلغ والعملات"},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            amount = Decimal(str(amount))  # المبلغ نص من الطلب، والملخصات تجمع Decimal
+        except InvalidOperation:
+            return Response(
+                {"error": "المبلغ غير صالح."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # إنشاء معاملة
-        transaction = Transaction.objects.create(
-            user=request.user,
-            transaction_type="deposit",  # أو "withdrawal"
-            amount=amount,
-            currency_from=currency_from,
-            currency_to=currency_to,
-            status="pending"
-        )
+        # إنشاء معاملة (الملخصات تحسبها مثل قائمة credit: حسب النوع وليس الحالة)
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(
+                user=request.user,
+                transaction_type="deposit",  # أو "withdrawal"
+                amount=amount,
+                currency_from=currency_from,
+                currency_to=currency_to,
+                status="pending"
+            )
+            record_rollups([transaction])
 
         return Response({
             "message": "تم بدء عملية الدفع",
@@ -658,6 +1002,7 @@ class GuestTransactionView(APIView):
     """
     إجراء معاملة كضيف
     """
+    @idempotent
     def post(self, request):
         # التحقق من توكن الضيف
         temp_token = request.headers.get('X-Guest-Token')
@@ -712,11 +1057,62 @@ class DeliveryTransactionView(APIView):
         # الحصول على جميع المعاملات المُسندة للمندوب
         transactions = Transaction.objects.filter(
             delivery_agent=request.user
-        ).select_related('user', 'recipient').order_by('-timestamp')
+        ).select_related('user', 'recipient')
 
-        serializer = DeliveryTransactionSerializer(transactions, many=True)
-        return Response(serializer.data)  # ✅ فقط القائمة، بدون count أو transactions
-# views.py
+        paginator = TransactionCursorPagination()
+        page = paginator.paginate_queryset(transactions, request, view=self)
+        serializer = DeliveryTransactionSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+class DeliveryRouteView(APIView):
+    """
+    ترتيب تسليمات المندوب المفتوحة في مسار قيادة فعال من موقعه الحالي
+    مع المسافة التراكمية والوقت المتوقع لكل محطة.
+    """
+    permission_classes = [IsAuthenticated, IsDeliveryStaff]
+
+    def get(self, request):
+        location = location_store.get(request.user.id)
+        if not location:
+            return Response(
+                {"error": "المندوب لم يُفعّل تتبع الموقع بعد."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        transactions = Transaction.objects.filter(
+            delivery_agent=request.user,
+            delivery_status__in=ACTIVE_DELIVERY_STATUSES,
+            recipient_latitude__isnull=False,
+            recipient_longitude__isnull=False,
+        ).select_related('user', 'recipient')
+
+        route = plan_route(
+            request.user.id,
+            (location.latitude, location.longitude),
+            list(transactions)
+        )
+
+        speed = agent_speed(request.user.id)
+        stops = []
+        for position, (transaction, leg, cumulative) in enumerate(route, start=1):
+            stop = DeliveryTransactionSerializer(transaction).data
+            stop.update({
+                "stop": position,
+                "leg_distance_km": round(leg, 2),
+                "cumulative_distance_km": round(cumulative, 2),
+                "eta_minutes": round(eta_minutes(cumulative, speed), 1),
+            })
+            stops.append(stop)
+
+        return Response({
+            "start": {
+                "latitude": location.latitude,
+                "longitude": location.longitude,
+                "updated_at": location.updated_at
+            },
+            "total_distance_km": round(route[-1][2], 2) if route else 0,
+            "average_speed_kmh": round(speed, 1),
+            "stops": stops
+        })
 
 
 # views.py
@@ -758,20 +1154,14 @@ from rest_framework.permissions import IsAuthenticated
 class WalletTransactionView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         serializer = WalletTransactionSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
+            if wants_async(request):
+                return queued_response(enqueue(request.user, 'wallet', request.data))
             transaction = serializer.save()
-            return Response({
-                "message": "تمت العملية بنجاح.",
-                "transaction": {
-                    "id": transaction.id,
-                    "type": transaction.transaction_type,
-                    "amount": transaction.amount,
-                    "currency": transaction.currency_from,
-                    "your_balance": request.user.total_balance
-                }
-            }, status=201)
+            return Response(wallet_result(transaction, request.user), status=201)
         return Response(serializer.errors, status=400)
     
 
@@ -784,13 +1174,28 @@ from rest_framework.permissions import IsAuthenticated
 class MyBalanceView(APIView):
     """
     عرض رصيد المستخدم الحالي (total_balance)
+    مع ?as_of=<ISO datetime> يُحسب رصيد المحفظة في ذلك الوقت من دفتر القيود.
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
         serializer = MyBalanceSerializer(user)
-        return Response(serializer.data)
+        data = serializer.data
+        if user.sharded_balance:
+            # الحسابات المجزأة: الرصيد يشمل الأرصدة الفرعية غير المدموجة
+            data['total_balance'] = wallet_balance(user.id, sharded=True)
+
+        as_of = request.query_params.get('as_of')
+        if as_of:
+            at = parse_datetime(as_of)
+            if at is None:
+                return Response({"error": "صيغة as_of غير صحيحة."}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            data['as_of'] = at
+            data['total_balance'] = balance_as_of(wallet_account(user.id), at)
+        return Response(data)
 
 # views.py
 
@@ -802,13 +1207,44 @@ class GetAllBalancesView(APIView):
     """
     عرض جميع المستخدمين مع رصيد total_balance
     فقط للإدارة
+    مرتبة تنازليًا بالرصيد ومرقمة بالمؤشر (?cursor= من حقل next، و ?page_size=).
+    ?count=estimate (الافتراضي، من إحصاءات قاعدة البيانات) أو exact أو none.
     """
     permission_classes = [IsAuthenticated, IsAdminUser]
 
+    FIELDS = ('id', 'first_name', 'last_name', 'email', 'phone_number', 'role', 'status', 'total_balance')
+
     def get(self, request):
-        users = User.objects.all().order_by('-total_balance')
-        serializer = UserBalanceSerializer(users, many=True)
+        count_mode = request.query_params.get('count', 'estimate')
+        if count_mode not in ('estimate', 'exact', 'none'):
+            return Response(
+                {"error": "قيمة count يجب أن تكون estimate أو exact أو none."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        users = User.objects.all()
+        # مسار سريع: قواميس من .values() بدل كائنات User و UserBalanceSerializer (نفس شكل الاستجابة)
+        rows, next_url = BalanceKeysetPagination().paginate_queryset(users.values(*self.FIELDS), request)
+        users_data = [
+            {
+                "id": row['id'],
+                "full_name": f"{row['first_name']} {row['last_name']}".strip(),
+                "email": row['email'],
+                "phone_number": row['phone_number'],
+                "role": row['role'],
+                "status": row['status'],
+                "total_balance": str(row['total_balance']),
+            }
+            for row in rows
+        ]
+
+        count = None
+        if count_mode == 'estimate':
+            count = estimated_count(users)
+        elif count_mode == 'exact':
+            count = users.count()
         return Response({
-            "count": users.count(),
-            "users": serializer.data
+            "count": count,
+            "next": next_url,
+            "users": users_data
         })
\ No newline at end of file
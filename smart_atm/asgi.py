@@ -3,6 +3,16 @@ ASGI config for smart_atm project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live tracking stream (``api/transactions/<pk>/track/stream/``) is an
+async Server-Sent Events view and needs this entry point, e.g.::
+
+    gunicorn smart_atm.asgi:application -k uvicorn.workers.UvicornWorker
+
+Under the WSGI entry point the async stream is buffered until it ends
+(up to TRACKING_STREAM_MAX_SECONDS) instead of being sent as events.
+Browsers open the stream with a short-lived ``?token=`` issued by
+``POST api/transactions/<pk>/track/stream-token/``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -184,4 +184,81 @@ SIMPLE_JWT = {
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "AUTH_HEADER_TYPES": ("Bearer",),
-}
\ No newline at end of file
+}
+
+# --- توزيع المندوبين (Dispatch) ---
+DISPATCH_SEARCH_MODE = 'grid'       # 'grid' فهرس في الذاكرة، أو 'bbox' فلترة SQL بصندوق إحداثيات
+DISPATCH_BBOX_INITIAL_KM = 5        # نصف قطر البحث الأولي في وضع bbox (يتضاعف عند عدم وجود نتائج)
+DISPATCH_BBOX_MAX_KM = 20000        # أقصى نصف قطر في وضع bbox
+DISPATCH_GRID_CELL_DEG = 0.05       # حجم خلية الفهرس الجغرافي بالدرجات (~5.5 كم)
+DISPATCH_INDEX_TTL = 60             # إعادة بناء الفهرس كل 60 ثانية لالتقاط تحديثات العمليات الأخرى
+DISPATCH_MAX_DISTANCE_KM = None     # أقصى مسافة للمندوب (None = بدون حد)
+DISPATCH_CANDIDATES = 10            # عدد أقرب المندوبين الذين تتم مفاضلتهم حسب الحمل
+DISPATCH_LOAD_PENALTY_KM = 2.0      # كل تسليم نشط يعادل 2 كم إضافية في درجة المندوب
+DISPATCH_MAX_ACTIVE_DELIVERIES = None  # أقصى عدد تسليمات نشطة للمندوب (None = بدون حد)
+SCHEDULED_AGENT_CAPACITY = 3        # أقصى تسليمات مجدولة للمندوب في النافذة الزمنية الواحدة
+
+# --- مخزن مواقع المندوبين (write-behind) ---
+LOCATION_FLUSH_INTERVAL = 5         # كتابة آخر المواقع إلى قاعدة البيانات كل 5 ثوانٍ
+LOCATION_MAX_STALENESS = 120        # مدة صلاحية الموقع في الكاش قبل الرجوع لقاعدة البيانات
+LOCATION_BULK_MAX_POINTS = 1000     # أقصى عدد نقاط في دفعة GPS واحدة
+
+# --- المسارات والوقت المتوقع ---
+DELIVERY_AVERAGE_SPEED_KMH = 36     # السرعة الافتراضية للمندوب لحساب الوقت المتوقع
+ROUTE_PLAN_TTL = 3600               # مدة بقاء خطة المسار في الكاش (تتجدد عند تغير التسليمات)
+
+# --- محرك الوقت المتوقع (سرعة المندوب الفعلية) ---
+LOCATION_HISTORY_MIN_INTERVAL = 15  # نقطة واحدة على الأكثر في سجل المواقع كل 15 ثانية لكل مندوب
+ETA_SPEED_HALF_LIFE = 600           # نصف عمر المتوسط المتحرك للسرعة بالثواني (~10 دقائق)
+ETA_MIN_SAMPLES = 3                 # أقل عدد قياسات قبل اعتماد السرعة الفعلية بدل الافتراضية
+ETA_MIN_SPEED_KMH = 10              # حد أدنى للسرعة حتى لا يصبح الوقت المتوقع لا نهائيًا عند التوقف
+ETA_MAX_SPEED_KMH = 160             # القفزات الأسرع من هذا تُعتبر أخطاء GPS وتُتجاهل
+ETA_SUMMARY_TTL = 21600             # مدة بقاء ملخص السرعة في الكاش (6 ساعات)
+
+# --- التتبع المباشر (SSE عبر ASGI) ---
+TRACKING_POLL_INTERVAL = 5          # قراءة الكاش لالتقاط تحديثات العمليات الأخرى
+TRACKING_STATUS_CHECK_INTERVAL = 30 # التحقق من انتهاء التسليم
+TRACKING_STREAM_MAX_SECONDS = 300   # مدة البث القصوى قبل أن يعيد العميل الاتصال
+TRACKING_STREAM_TOKEN_TTL = 60      # صلاحية رمز البث (?token=) بالثواني
+
+# --- دفتر القيود ولقطات الأرصدة ---
+LEDGER_SNAPSHOT_LAG = 60            # اللقطة تغطي القيود حتى (الآن - 60 ثانية) لتجنب معاملات لم تُثبَّت بعد
+
+# --- الأرصدة الفرعية للحسابات الساخنة ---
+BALANCE_SHARDS = 8                  # عدد الأرصدة الفرعية للحسابات المجزأة (User.sharded_balance)
+
+# --- التحويلات الجماعية (الرواتب) ---
+PAYROLL_MAX_ROWS = 10000            # أقصى عدد صفوف في دفعة تحويل واحدة
+PAYROLL_CHUNK_SIZE = 500            # حجم الدفعة الجزئية للتحديث والإنشاء الجماعي
+
+# --- مفاتيح Idempotency-Key لنقاط الأموال ---
+IDEMPOTENCY_TTL = 86400             # مدة حفظ الاستجابة لإعادتها للطلبات المكررة (24 ساعة)
+IDEMPOTENCY_LOCK_TIMEOUT = 300      # مدة حجز المفتاح أثناء التنفيذ (أطول من أطول طلب؛ يُحرر تلقائيًا إن توقفت العملية)
+IDEMPOTENCY_WAIT_SECONDS = 10       # أقصى انتظار للطلب المكرر قبل الرد بـ 409
+IDEMPOTENCY_POLL_INTERVAL = 0.1     # فترة فحص اكتمال الطلب الأول
+
+# --- الترحيل غير المتزامن للمعاملات (?async=1 أو Prefer: respond-async) ---
+POSTING_BATCH_SIZE = 100            # عدد المهام التي يحجزها العامل في كل دفعة
+POSTING_CLAIM_TIMEOUT = 300         # المهمة العالقة في processing أطول من هذا تُعاد للطابور
+POSTING_MAX_ATTEMPTS = 3            # بعدها تُعلَّم المهمة كفاشلة
+
+# --- أسعار الصرف ---
+EXCHANGE_RATE_BASE = 'USD'          # جدول واحد لعملة الأساس تُشتق منه كل الأزواج
+EXCHANGE_RATE_TTL = 3600            # بعدها يُعتبر الجدول قديمًا ويُحدَّث في الخلفية
+EXCHANGE_RATE_MAX_STALE = 86400     # أقصى مدة لخدمة جدول قديم إذا تعذر التحديث
+EXCHANGE_RATE_WAIT_SECONDS = 5      # انتظار جلب تقوم به عملية أخرى قبل الجلب مباشرة
+EXCHANGE_RATE_PROVIDER = 'core.rates.HTTPRateProvider'  # أو FileRateProvider / FixedRateProvider
+EXCHANGE_RATE_PROVIDER_OPTIONS = {}  # معاملات المزوّد، مثل {'path': BASE_DIR / 'rates.csv'}
+EXCHANGE_RATE_SNAPSHOT = BASE_DIR / 'var' / 'exchange_rates.json'  # يكتبه refresh_rates ويقرؤه العمال
+EXCHANGE_RATE_SNAPSHOT_CHECK = 30   # فحص تغيّر ملف اللقطة كل 30 ثانية
+EXCHANGE_RATE_MATRIX = BASE_DIR / 'var' / 'exchange_rates.matrix.json'  # مصفوفة كل الأزواج (.npy عبر mmap)
+TRANSFER_FEE_RATE = '0.10'          # عمولة التحويل (المستلم يحصل على 90%)
+FX_QUOTE_TTL = 60                   # صلاحية عرض السعر المثبت بالثواني
+
+
+# --- ترقيم سجل المعاملات ---
+TRANSACTION_PAGE_SIZE = 50          # حجم الصفحة الافتراضي (?page_size= لتغييره)
+TRANSACTION_MAX_PAGE_SIZE = 200     # أقصى حجم صفحة يمكن طلبه
+BALANCE_PAGE_SIZE = 100             # حجم صفحة قائمة الأرصدة للإدارة
+BALANCE_MAX_PAGE_SIZE = 500         # أقصى حجم صفحة لقائمة الأرصدة
+STATEMENT_CHUNK_SIZE = 2000         # صفوف كل جلب من مؤشر قاعدة البيانات عند تصدير الكشف